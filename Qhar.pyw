@@ -19,6 +19,7 @@ __license__ = "GPLv3"
 # along with Qhar.  If not, see <http://www.gnu.org/licenses/>.
 
 import sys
+from datetime import timedelta
 from PyQt4.QtCore import *
 from PyQt4.QtGui import *
 from Qhar_main_ui import *
@@ -26,15 +27,24 @@ from Qhar_data import *
 from Qhar_files import *
 from Qhar_settings import *
 from Qhar_view import *
+from Qhar_models import *
+from Qhar_workers import *
+from Qhar_instrument import instruments
 
 
 class Qhar_MainWindow(RecipeContainer, QMainWindow, Ui_MainWindow):
+    # timings can be reported by worker threads
+    timing_reported = pyqtSignal(str)
+
     def __init__(self):
         super(Qhar_MainWindow, self).__init__()
         self.setupUi(self)
         self.load_settings()
         self.create_items()
         self.connect_actions_and_signals()
+        if instruments.configure():
+            instruments.add_sink(self.timing_reported.emit)
+        self.journal_changes = True
         self.set_recipe_filter(True)
         self.file_open(True)
 
@@ -45,20 +55,51 @@ class Qhar_MainWindow(RecipeContainer, QMainWindow, Ui_MainWindow):
         self.dateEdit.setCalendarPopup(True)
         self.dateEdit.setObjectName("dateEdit")
         self.dateEdit.setDisplayFormat(self.date_string)
-        self.dateEdit.setDate(self.current_date)
+        self.dateEdit.setDate(QDate(self.current_date))
         self.label_filter.setText("Filter")
         self.comboBox_filter.addItem("All")
         self.comboBox_filter.addItems(list(self.recipe_types.values()))
+        self.lineEdit_search = QLineEdit(self.page_view)
+        self.lineEdit_search.setObjectName("lineEdit_search")
+        self.lineEdit_search.setPlaceholderText("Search name or book")
+        self.horizontalLayout_2.insertWidget(2, self.lineEdit_search)
+        # search once typing pauses, not on every key
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(250)
+        # journaled changes reach the disk within a second and the database
+        # within autosave_interval seconds
+        self.journal_timer = QTimer(self)
+        self.journal_timer.setInterval(500)
+        self.journal_timer.start()
+        self.autosave_timer = QTimer(self)
+        self.autosave_timer.setInterval(1000 * self.autosave_interval)
+        if self.autosave_interval > 0:
+            self.autosave_timer.start()
         self.pushButton_select.setText("Select")
         self.pushButton_select.setHidden(True)
-        tables = [self.tableWidget_view, self.tableWidget_week]
-        horizontal_header_labels = [" ", "Main Dish ID", self.arguments["name"],
-                                    self.arguments["book"], self.arguments["page"],
-                                    self.arguments["time_to_cook"], self.arguments["side_dish_id"],
-                                    self.arguments["side_dish_id"].replace("ID", "")]
-        for table in tables:
-            table.setHorizontalHeaderLabels(horizontal_header_labels)
-            table.verticalHeader().setResizeMode(QHeaderView.Stretch)
+        self.progressBar = QProgressBar()
+        self.progressBar.setMaximumWidth(150)
+        self.progressBar.setRange(0, 100)
+        self.progressBar.setHidden(True)
+        self.pushButton_cancel = QPushButton(QIcon.fromTheme("process-stop"), "Cancel")
+        self.pushButton_cancel.setHidden(True)
+        self.statusBar().addPermanentWidget(self.progressBar)
+        self.statusBar().addPermanentWidget(self.pushButton_cancel)
+        self.worker_thread = None
+        self.worker = None
+        self.loading_database = None
+        self.week_shown = False
+        self.view_model = RecipeTableModel(self, self)
+        self.tableView_view.setModel(self.view_model)
+        self.tableView_view.setItemDelegateForColumn(0, StatusDelegate(self.tableView_view))
+        self.tableView_view.setItemDelegateForColumn(5, TimeToCookDelegate(self.tableView_view))
+        self.tableView_view.setSortingEnabled(True)
+        # rows of the view all have the same height, don't measure them
+        self.tableView_view.verticalHeader().setResizeMode(QHeaderView.Fixed)
+        self.tableWidget_week.setHorizontalHeaderLabels(self.view_model.headers)
+        self.tableWidget_week.verticalHeader().setResizeMode(QHeaderView.Stretch)
+        for table in [self.tableView_view, self.tableWidget_week]:
             table.setColumnWidth(0, 5)
             table.setColumnHidden(1, True)
             table.setColumnHidden(6, True)
@@ -66,16 +107,7 @@ class Qhar_MainWindow(RecipeContainer, QMainWindow, Ui_MainWindow):
     def status_row_label(self, id, status):
         """Create a custom QLabel which doesn't get deleted when table
         contents are cleared"""
-        if status == "TODAY":
-            color = "yellow"
-        elif status == "INSERT":
-            color = "blue"
-        elif status == "UPDATE":
-            color = "green"
-        elif status == "DELETE":
-            color = "red"
-        else:
-            color = "gray"
+        color = StatusDelegate.colors.get(status, "gray")
         label = QLabel()
         label.setObjectName("status_label_{0}".format(id))
         label.setStyleSheet("QLabel#status_label_{0} {{background-color: {1};}}".format(id, color))
@@ -100,11 +132,11 @@ class Qhar_MainWindow(RecipeContainer, QMainWindow, Ui_MainWindow):
             action_dateEdit.setVisible(True)
 
             self.action_View.setDisabled(state)
-            if len(self.recipes) == 0:
+            if len(self) == 0:
                 state = False
             self.action_Remove.setEnabled(state)
             self.action_Edit.setEnabled(state)
-            if len(self.recipes) == 0:
+            if len(self) == 0:
                 state = True
             self.action_Replace.setDisabled(state)
             self.action_Previous_week.setDisabled(state)
@@ -112,15 +144,12 @@ class Qhar_MainWindow(RecipeContainer, QMainWindow, Ui_MainWindow):
             action_dateEdit.setDisabled(state)
 
         if which_ui == "Main":
-            table = self.tableWidget_week
             actions_common(False)
             self.stackedWidget_main.setCurrentIndex(0)
-            table.clearContents()
+            self.tableWidget_week.clearContents()
         else:
-            table = self.tableWidget_view
             actions_common(True)
             self.stackedWidget_main.setCurrentIndex(1)
-            table.setRowCount(0)
 
     def connect_actions_and_signals(self):
         """Set connections for the actions and signals not set in .ui"""
@@ -146,20 +175,21 @@ class Qhar_MainWindow(RecipeContainer, QMainWindow, Ui_MainWindow):
         self.action_Settings.triggered.connect(self.settings_dialog)
 
         self.comboBox_filter.currentIndexChanged.connect(self.set_recipe_filter)
+        self.lineEdit_search.textChanged.connect(self.search_timer.start)
+        self.search_timer.timeout.connect(self.search_view)
+        self.journal_timer.timeout.connect(self.sync_journal)
+        self.autosave_timer.timeout.connect(self.autosave)
+        self.timing_reported.connect(self.listWidget_log.addItem)
         self.pushButton_select.clicked.connect(self.select_side_dish)
-        self.tableWidget_view.cellClicked.connect(lambda: self.pushButton_select.setEnabled(True))
+        self.tableView_view.clicked.connect(lambda: self.pushButton_select.setEnabled(True))
         self.tableWidget_week.doubleClicked.connect(lambda: self.set_recipe_filter(current_text=self.recipe_types["side_dish"]))
 
     def select_side_dish(self):
         """Select the side dish and attach it to the caller id"""
         recipe_row_num = self.tableWidget_week.currentRow()
         recipe_id = self.tableWidget_week.item(recipe_row_num, 1).text()
-        side_dish_row_num = self.tableWidget_view.currentRow()
-        side_dish_id = self.tableWidget_view.item(side_dish_row_num, 1).text()
-        recipe_item = self.recipes[recipe_id]
-        recipe_item["side_dish_id"] = side_dish_id
-        recipe_item.sql_action = "UPDATE"
-        self.unsaved = True
+        side_dish_id = self.view_model.recipe_id(self.tableView_view.currentIndex().row())
+        self.set_side_dish(recipe_id, side_dish_id)
         self.pushButton_select.setVisible(False)
         self.populate_table(which_ui="Main", randomize=False)
 
@@ -185,59 +215,70 @@ class Qhar_MainWindow(RecipeContainer, QMainWindow, Ui_MainWindow):
             self.filter = recipe_types
         self.populate_table(which_ui="View")
 
-    def populate_table(self, which_ui="Main", randomize=True):
-        """Populate rows of the table currently shown."""
-        def tables_common(table, row_num, recipe_id, recipe_item, label):
-            """Common rows for the week and view tables"""
-            table.setVerticalHeaderItem(row_num, QTableWidgetItem("{}".format(label)))
-            time_to_cook_widget = self.time_to_cook_checkbox(recipe_item["time_to_cook"],recipe_item["exact_time_to_cook"])
-            table.setItem(row_num, 1, QTableWidgetItem("{}".format(recipe_id)))
-            table.setItem(row_num, 2, QTableWidgetItem(recipe_item["name"]))
-            table.setItem(row_num, 3, QTableWidgetItem(recipe_item["book"]))
-            table.setItem(row_num, 4, QTableWidgetItem("{}".format(recipe_item["page"])))
-            table.setCellWidget(row_num, 5, time_to_cook_widget)
-            if recipe_item["recipe_type"] != self.recipe_types["side_dish"]:
-                side_dish_id = recipe_item["side_dish_id"]
-                if side_dish_id is not None and side_dish_id in self.recipes.keys():
-                    side_dish_item = self.recipes[side_dish_id]
-                    table.setItem(row_num, 6, QTableWidgetItem("{}".format(side_dish_id)))
-                    table.setItem(row_num, 7, QTableWidgetItem(side_dish_item["name"]))
+    def search_view(self):
+        """Show the recipes matching the text of the search box"""
+        self.set_search(self.lineEdit_search.text())
+        self.view_model.reset_recipes()
+        if len(self.search_words) > 0 and self.search_limited:
+            self.logger("Showing the best {0} matches only, refine the search to see others".format(
+                self.recipe_count()))
+
+    def fill_row(self, table, row_num, recipe_id, recipe_item, label, side_dishes):
+        """Fill the recipe columns of a row in the week table"""
+        table.setVerticalHeaderItem(row_num, QTableWidgetItem("{}".format(label)))
+        time_to_cook_widget = self.time_to_cook_checkbox(recipe_item["time_to_cook"],recipe_item["exact_time_to_cook"])
+        table.setItem(row_num, 1, QTableWidgetItem("{}".format(recipe_id)))
+        table.setItem(row_num, 2, QTableWidgetItem(recipe_item["name"]))
+        table.setItem(row_num, 3, QTableWidgetItem(recipe_item["book"]))
+        table.setItem(row_num, 4, QTableWidgetItem("{}".format(recipe_item["page"])))
+        table.setCellWidget(row_num, 5, time_to_cook_widget)
+        if recipe_item["recipe_type"] != self.recipe_types["side_dish"]:
+            side_dish_id = recipe_item["side_dish_id"]
+            if side_dish_id in side_dishes:
+                table.setItem(row_num, 6, QTableWidgetItem("{}".format(side_dish_id)))
+                table.setItem(row_num, 7, QTableWidgetItem(side_dishes[side_dish_id]["name"]))
+            else:
+                cell_item = QTableWidgetItem("Select side dish")
+                cell_item.setToolTip("Doubleclick to select side dish")
+                table.setItem(row_num, 7, cell_item)
+
+    def populate_week_row(self, row_num, start_of_week, side_dishes):
+        """Show the recipe planned for row row_num of the week table"""
+        row_date = start_of_week + timedelta(days=row_num)
+        day = start_of_week.toordinal() + row_num
+        if day in self.recipe_map:
+            recipe_id = self.recipe_map[day]
+            if recipe_id is not None:
+                recipe_item = self.recipes[recipe_id]
+                if row_date == self.current_date:
+                    self.tableWidget_week.setCellWidget(row_num, 0, self.status_row_label(recipe_id,"TODAY"))
                 else:
-                    cell_item = QTableWidgetItem("Select side dish")
-                    cell_item.setToolTip("Doubleclick to select side dish")
-                    table.setItem(row_num, 7, cell_item)
+                    self.tableWidget_week.setCellWidget(row_num, 0, self.status_row_label(recipe_id,recipe_item.sql_action))
+                self.fill_row(self.tableWidget_week, row_num, recipe_id, recipe_item,
+                              QDate(row_date).toString("dddd\n(d.M)"), side_dishes)
+            else:
+                self.tableWidget_week.setItem(row_num, 1, QTableWidgetItem("No appropriate recipe"))
+                for col_num in range(2, 6):
+                    self.tableWidget_week.setItem(row_num, col_num, QTableWidgetItem("N/A"))
 
+    def populate_table(self, which_ui="Main", randomize=True):
+        """Populate rows of the table currently shown."""
         self.set_layout(which_ui)
-        if len(self.recipes) > 0:
+        if len(self) > 0:
             if which_ui == "Main":
                 self.select_recipes(randomize)
-                start_of_week = self.selected_date.addDays(1 - self.selected_date.dayOfWeek())
+                start_of_week = self.selected_date - timedelta(days=self.selected_date.weekday())
+                first_day = start_of_week.toordinal()
+                week = [self.recipe_map.get(first_day + row_num) for row_num in range(7)]
+                side_dishes = self.lookup_recipes(self.recipes[recipe_id]["side_dish_id"]
+                                                  for recipe_id in week if recipe_id is not None)
                 for row_num in range(7):
-                    row_date = start_of_week.addDays(row_num)
-                    row_date_string = row_date.toString(self.date_string)
-                    if row_date_string in self.recipe_map:
-                        recipe_id = self.recipe_map[row_date_string]
-                        if recipe_id is not None:
-                            recipe_item = self.recipes[recipe_id]
-                            if row_date == self.current_date:
-                                self.tableWidget_week.setCellWidget(row_num, 0, self.status_row_label(recipe_id,"TODAY"))
-                            else:
-                                self.tableWidget_week.setCellWidget(row_num, 0, self.status_row_label(recipe_id,recipe_item.sql_action))
-                            tables_common(self.tableWidget_week, row_num, recipe_id, recipe_item, row_date.toString("dddd\n(d.M)"))
-                        else:
-                            self.tableWidget_week.setItem(row_num, 1, QTableWidgetItem("No appropriate recipe"))
-                            for col_num in range(2, 6):
-                                self.tableWidget_week.setItem(row_num, col_num, QTableWidgetItem("N/A"))
+                    self.populate_week_row(row_num, start_of_week, side_dishes)
             else:
-                row_num = 0
-                for recipe_id, recipe_item in self.recipes.items():
-                    if recipe_item["recipe_type"] in self.filter:
-                        self.tableWidget_view.insertRow(row_num)
-                        self.tableWidget_view.setCellWidget(row_num, 0, self.status_row_label(recipe_id, recipe_item.sql_action))
-                        tables_common(self.tableWidget_view, row_num, recipe_id, recipe_item, row_num + 1)
-                        row_num += 1
-                # self.tableWidget_view.sortByColumn(2, 0) # BUG: this causes items to dissapear
+                self.view_model.reset_recipes()
         else:
+            if which_ui != "Main":
+                self.view_model.reset_recipes()
             self.logger((False, "Recipe list is empty. Import or add some items"))
 
     def select_week(self, by=0, randomize=False):
@@ -247,45 +288,124 @@ class Qhar_MainWindow(RecipeContainer, QMainWindow, Ui_MainWindow):
             if by == 0:
                 self.selected_date = self.current_date
             else:
-                self.selected_date = self.selected_date.addDays(by*7)
-            self.dateEdit.setDate(self.selected_date)
+                self.selected_date = self.selected_date + timedelta(weeks=by)
+            self.dateEdit.setDate(QDate(self.selected_date))
         else:
-            self.selected_date = self.dateEdit.date()
+            self.selected_date = self.dateEdit.date().toPyDate()
 
         self.populate_table(randomize=False)
 
-        self.dateEdit.setMinimumDate(self.date_of_expiry[0])
-        self.dateEdit.setMaximumDate(self.date_of_expiry[1])
+        self.dateEdit.setMinimumDate(QDate(self.date_of_expiry[0]))
+        self.dateEdit.setMaximumDate(QDate(self.date_of_expiry[1]))
 
-        if self.date_of_expiry[0] >= self.selected_date.addDays(1 - self.selected_date.dayOfWeek()):
+        start_of_week = self.selected_date - timedelta(days=self.selected_date.weekday())
+        if self.date_of_expiry[0] >= start_of_week:
             self.action_Previous_week.setDisabled(True)
         else:
             self.action_Previous_week.setEnabled(True)
-        if self.date_of_expiry[1] <= self.selected_date.addDays(1 - self.selected_date.dayOfWeek() + 7):
+        if self.date_of_expiry[1] <= start_of_week + timedelta(weeks=1):
             self.action_Next_week.setDisabled(True)
         else:
             self.action_Next_week.setEnabled(True)
 
     def replace_row(self):
-        """Clear last_cooked date of selected item and select a new one"""
+        """Plan another recipe for the day of the selected row, only that row
+        is shown again"""
         row_num = self.tableWidget_week.currentRow()
-        recipe_id = self.tableWidget_week.item(row_num, 1).text()
-        recipe_item = self.recipes[recipe_id]
-        recipe_item["last_cooked"] = None
-        recipe_item.sql_action = "UPDATE"
-        self.unsaved = True
-        self.populate_table(randomize=True)
+        if row_num < 0:
+            return
+        start_of_week = self.selected_date - timedelta(days=self.selected_date.weekday())
+        recipe_id = self.replan_day(start_of_week.toordinal() + row_num)
+        if recipe_id is None:
+            self.logger((False, "No other recipe fits this day"))
+            return
+        side_dishes = self.lookup_recipes([self.recipes[recipe_id]["side_dish_id"]])
+        # the cells of the previous recipe may not all be overwritten
+        for col_num in range(self.tableWidget_week.columnCount()):
+            self.tableWidget_week.removeCellWidget(row_num, col_num)
+            self.tableWidget_week.takeItem(row_num, col_num)
+        self.populate_week_row(row_num, start_of_week, side_dishes)
         self.tableWidget_week.selectRow(row_num)
 
     def file_import(self):
-        """Invoke the data import dialog and update the table if
-        import was successfull"""
+        """Invoke the data import dialog and import the file on a worker
+        thread. Recipes are merged chunk by chunk while the file is read. A
+        database opened in windowed mode is imported into directly."""
         path = "."  # TODO implement recent files
         filename = QFileDialog.getOpenFileName(self, "Import file", path, "Supported formats (%s)"
                                                % ImportExportHandler().formats())
-        if filename is not None and bool(filename) is not False:
-            if self.logger(self.load_data(filename, "FILE")):
-                self.select_week(randomize=True)
+        if filename is not None and bool(filename) is not False and self.worker_thread is None:
+            self.import_imported = 0
+            if self.repository is not None:
+                worker = ImportWorker(filename, self.connection.filename)
+            else:
+                worker = ImportWorker(filename)
+            self.logger("Importing {0} ...".format(filename))
+            self.start_worker(worker, self.import_chunk, self.import_finished)
+
+    def start_worker(self, worker, chunk_slot, done_slot):
+        """Run worker on its own thread, its chunks and result are handled
+        by the given slots on the GUI thread"""
+        self.worker_thread = QThread(self)
+        self.worker = worker
+        self.worker.moveToThread(self.worker_thread)
+        self.worker_thread.started.connect(self.worker.run)
+        self.worker.chunk_ready.connect(chunk_slot)
+        self.worker.progress.connect(self.progressBar.setValue)
+        self.worker.done.connect(done_slot)
+        # the worker thread is busy in run(), its event loop would never
+        # deliver a queued call
+        self.pushButton_cancel.clicked.connect(self.worker.cancel, Qt.DirectConnection)
+        self.set_worker_running(True)
+        self.worker_thread.start()
+
+    def stop_worker(self):
+        """Stop the worker thread and return the worker"""
+        worker = self.worker
+        self.worker_thread.quit()
+        self.worker_thread.wait()
+        self.worker_thread = None
+        self.worker = None
+        self.pushButton_cancel.clicked.disconnect()
+        self.set_worker_running(False)
+        return worker
+
+    def set_worker_running(self, running):
+        """Show the progress of the worker and disable the actions which
+        would replace or save the recipe list while it runs"""
+        self.progressBar.setValue(0)
+        self.progressBar.setVisible(running)
+        self.pushButton_cancel.setVisible(running)
+        self.action_Import.setDisabled(running)
+        self.action_Open.setDisabled(running)
+        self.action_New.setDisabled(running)
+        self.action_Save.setDisabled(running)
+        self.action_SaveAs.setDisabled(running)
+
+    def import_chunk(self, recipes, rows):
+        """Merge a chunk of imported recipes into the recipe list"""
+        num = self.merge_recipes(recipes)
+        self.import_imported += num
+        self.worker.chunk_merged()
+        self.logger("Imported {0} new recipes from {1} rows ({2} so far)".format(num, rows, self.import_imported))
+
+    def import_finished(self, ret):
+        """Stop the import thread and show the imported recipes"""
+        worker = self.stop_worker()
+        validator = worker.validator
+        database = worker.database
+        self.logger(ret)
+        if validator is not None:
+            # list why rows were rejected, but don't flood the log
+            self.listWidget_log.addItems(validator.report(50))
+        if database is not None:
+            self.database_changed(database)
+            self.select_week(randomize=True)
+        elif self.import_imported > 0:
+            self.logger((True, "Imported {0} new recipes".format(self.import_imported)))
+            self.select_week(randomize=True)
+        else:
+            self.logger((False, "No new recipes imported"))
 
     def file_export(self):
         """Invoke the data export dialog"""
@@ -302,19 +422,86 @@ class Qhar_MainWindow(RecipeContainer, QMainWindow, Ui_MainWindow):
         if startup is False and self.can_continue():
             filename = QFileDialog.getOpenFileName(self, "Open Database", path,
                                                    "Supported formats (*.db)")
-            if filename is not None and bool(filename) is not False and self.logger(self.load_data(filename, "DB")):
-                self.database = filename
-                self.select_week(randomize=True)
+            if filename is not None and bool(filename) is not False:
+                self.open_database(filename)
         elif startup is not False:
-            if self.database is not None and self.logger(self.load_data(self.database, "DB")):
-                self.select_week(randomize=True)
-            elif self.database is None:
+            if self.database is not None:
+                self.open_database(self.database)
+            else:
                 self.select_week(randomize=False)
 
+    def open_database(self, filename):
+        """Load the database on a worker thread, so the window shows at once.
+        The week is planned and shown after the first chunk, which holds the
+        recipes it needs; the others are added to the view as they come."""
+        self.clear_recipes()
+        self.unsaved = False
+        self.loading_database = filename
+        self.week_shown = False
+        self.logger("Opening {0} ...".format(filename))
+        self.start_worker(LoadWorker(filename, self.window_threshold), self.load_chunk, self.load_finished)
+
+    def load_chunk(self, recipes, rows):
+        """Add a chunk of the recipes of the database which is being loaded"""
+        added = self.add_loaded(recipes)
+        self.worker.chunk_merged()
+        if not self.week_shown:
+            self.week_shown = True
+            # replayed now, so the week isn't planned over the journaled plans
+            if self.journal_changes:
+                num = self.open_journal(self.loading_database)
+                if num > 0:
+                    self.logger((True, "Recovered {0} unsaved changes".format(num)))
+            self.select_week(randomize=True)
+        elif self.stackedWidget_main.currentIndex() == 1:
+            self.view_model.recipes_added(added)
+
+    def load_finished(self, ret):
+        """Stop the load thread and show the whole recipe list"""
+        worker = self.stop_worker()
+        filename = self.loading_database
+        self.loading_database = None
+        if worker.windowed:
+            self.logger(ret)
+            ret = self.load_data(filename, "DB")
+        elif ret[0]:
+            self.finish_loading(filename, worker.from_snapshot)
+        else:
+            # the replayed changes weren't saved, keep them for the next load
+            self.rollback_journal()
+            self.clear_recipes()
+            self.unsaved = False
+        if self.logger(ret):
+            self.database = filename
+            self.select_week(randomize=True)
+        else:
+            self.select_week(randomize=False)
+        if self.stackedWidget_main.currentIndex() == 1:
+            self.view_model.reset_recipes()
+
+    def sync_journal(self):
+        if self.journal is not None:
+            self.journal.sync()
+
+    def autosave(self):
+        """Save the journaled changes into the database, unless an import is
+        running"""
+        if (self.unsaved and self.journal is not None and self.worker_thread is None and
+                self.database == self.journal.database):
+            status, msg = self.save_data(self.database, "DB")
+            if status:
+                self.unsaved = False
+                if self.stackedWidget_main.currentIndex() == 0:
+                    self.populate_table(randomize=False)
+                else:
+                    self.tableView_view.viewport().update()
+            else:
+                self.logger((status, "Autosave failed: {0}".format(msg)))
+
     def file_new(self):
         """Clear recipe list"""
         if self.can_continue():
-            self.recipes.clear()
+            self.clear_recipes()
             self.select_week(randomize=False)
 
     def file_save(self, saveas=False):
@@ -368,11 +555,66 @@ class Qhar_MainWindow(RecipeContainer, QMainWindow, Ui_MainWindow):
             status = False
         return status
 
+    def unsaved_changed(self, unsaved):
+        """Saving is only possible if there are unsaved changes"""
+        self.action_Save.setEnabled(unsaved)
+        self.action_SaveAs.setEnabled(unsaved)
+
+    def load_settings(self):
+        """This method tries to load settings from the default save location
+        in .config"""
+        settings = QSettings()
+        if settings.value("FirstRun") is not None:  
+            self.restoreGeometry(settings.value("MainWindow/Geometry"))
+            self.restoreState(settings.value("MainWindow/State"))
+            self.window_size = settings.value("MainWindow/Size", QSize(600, 500))
+            self.resize(self.window_size)
+
+            """The following values are saved into the recipe container"""
+            available_time = settings.value("Configuration/AvailableTime")
+            database = settings.value("Configuration/Database")
+            autosave_interval = settings.value("Configuration/AutosaveInterval")
+
+            if available_time is not None:
+                self.available_time = [int(item) for item in available_time]
+            if autosave_interval is not None:
+                self.autosave_interval = int(autosave_interval)
+            if database is not None and QFileInfo(database).exists():
+                self.database = database
+
+    def save_settings(self):
+        """This method gets executed after after the MainWindow is closed or if
+        the user clicks the settings dialog"""
+        settings = QSettings()
+        settings.setValue("FirstRun", "0")
+        
+        settings.setValue("MainWindow/Geometry", self.saveGeometry())
+        settings.setValue("MainWindow/State", self.saveState())
+        settings.setValue("MainWindow/Size", self.size())
+
+        if self.available_time is not None:
+            settings.setValue("Configuration/AvailableTime", self.available_time)
+        settings.setValue("Configuration/AutosaveInterval", self.autosave_interval)
+        if self.database is not None:
+            settings.setValue("Configuration/Database", self.database)
+            
+    def settings_dialog(self):
+        """Display settings dialog"""
+        pass
+
     def closeEvent(self, event):
         """On closing the MainWindow this method tries to save any unsaved changes
         before exiting the program"""
         if self.can_continue():
+            if self.worker_thread is not None:
+                self.worker.done.disconnect()
+                self.worker.cancel()
+                self.worker_thread.quit()
+                self.worker_thread.wait()
             self.save_settings()
+            self.close_journal()
+            self.close_database()
+            instruments.flush()
             event.accept()
         else:
             event.ignore()
@@ -389,6 +631,8 @@ class Qhar_MainWindow(RecipeContainer, QMainWindow, Ui_MainWindow):
                 return self.file_save()
         return True
 
+instruments.register(Qhar_MainWindow, "populate_table")
+
 if __name__ == "__main__":
     app = QApplication(sys.argv)
     app.setOrganizationName("Andrej Mernik")
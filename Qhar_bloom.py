@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+# This file is part of Qhar.
+# Qhar is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# Qhar is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with Qhar.  If not, see <http://www.gnu.org/licenses/>.
+
+import math
+
+
+class BloomFilter(object):
+    """This object tells if a recipe hash may have been added or certainly
+    wasn't. It takes about 1.2 bytes per hash at a 1% error rate, so the
+    hashes of a large database can be checked without loading them. The
+    recipe hashes are SHA-1 digests already, their bits are used as the
+    hash functions."""
+    __slots__ = ("size", "hashes", "bits", "count")
+
+    def __init__(self, capacity, error_rate=0.01):
+        capacity = max(capacity, 1)
+        self.size = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def positions(self, recipe_hash):
+        # double hashing with two 64 bit parts of the digest
+        first = int(recipe_hash[:16], 16)
+        second = int(recipe_hash[16:32], 16) | 1
+        size = self.size
+        return [(first + num * second) % size for num in range(self.hashes)]
+
+    def add(self, recipe_hash):
+        bits = self.bits
+        for position in self.positions(recipe_hash):
+            bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def update(self, recipe_hashes):
+        for recipe_hash in recipe_hashes:
+            self.add(recipe_hash)
+
+    def __contains__(self, recipe_hash):
+        bits = self.bits
+        for position in self.positions(recipe_hash):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def __len__(self):
+        return self.count
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+# This file is part of Qhar.
+# Qhar is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# Qhar is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with Qhar.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Plan menus, import or export recipes without the user interface, e.g.
+
+    Qhar_cli.py recipes.db --weeks 4 --format json --output menu.json
+    Qhar_cli.py recipes.db --export recipes.csv --columns name,book,page
+    Qhar_cli.py recipes.db --import more-recipes.csv
+"""
+
+import argparse
+import csv
+import json
+import sys
+from datetime import date, datetime
+from Qhar_data import RecipeContainer
+from Qhar_instrument import instruments
+
+
+class MenuPlanner(RecipeContainer):
+    """This object plans menus from a database without Qt"""
+    fields = ("date", "name", "book", "page", "time_to_cook", "recipe_type", "side_dish", "hash")
+
+    def plan(self, start, weeks):
+        """Plan weeks weeks from the monday of the week of start and return
+        the menu as a list of dicts, days without a recipe included"""
+        start = start.toordinal() - start.weekday()
+        end = start + 7 * weeks
+        self.select_recipes(True, start, end)
+        days = range(start, end)
+        planned = [self.recipe_map.get(day) for day in days]
+        side_dishes = self.lookup_recipes(self.recipes[recipe_id]["side_dish_id"]
+                                          for recipe_id in planned if recipe_id is not None)
+        menu = []
+        for day, recipe_id in zip(days, planned):
+            row = dict.fromkeys(self.fields)
+            row["date"] = date.fromordinal(day).isoformat()
+            if recipe_id is not None:
+                recipe = self.recipes[recipe_id]
+                for key in ("name", "book", "page", "time_to_cook", "recipe_type"):
+                    row[key] = recipe[key]
+                if recipe["side_dish_id"] in side_dishes:
+                    row["side_dish"] = side_dishes[recipe["side_dish_id"]]["name"]
+                row["hash"] = recipe_id
+            menu.append(row)
+        return menu
+
+    def write_menu(self, menu, output, output_format):
+        if output_format == "json":
+            json.dump(menu, output, ensure_ascii=False, indent=2)
+            output.write("\n")
+        else:
+            writer = csv.DictWriter(output, self.fields)
+            writer.writeheader()
+            writer.writerows(menu)
+
+
+def parse_date(value):
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").date()
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected a date as YYYY-MM-DD, got {0}".format(value))
+
+
+def parse_list(value):
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Plan menus from a Qhar database.")
+    parser.add_argument("database", help="the database to plan from")
+    parser.add_argument("-w", "--weeks", type=int, default=1, help="number of weeks to plan (default: 1)")
+    parser.add_argument("-s", "--start", type=parse_date, default=None,
+                        help="plan from the week of this date, YYYY-MM-DD (default: this week)")
+    parser.add_argument("-f", "--format", choices=("csv", "json"), default="csv", help="output format")
+    parser.add_argument("-o", "--output", default="-", help="output file (default: standard output)")
+    parser.add_argument("--save", action="store_true",
+                        help="store the planned dates in the database, so the next plans don't repeat them")
+    parser.add_argument("--import", dest="import_file", default=None, metavar="CSV",
+                        help="import the recipes of a CSV file into the database instead of planning, "
+                             "rejected rows are listed on stderr")
+    parser.add_argument("--export", default=None, metavar="CSV",
+                        help="export the recipes to a CSV file instead of planning")
+    parser.add_argument("--columns", type=parse_list, default=None,
+                        help="comma separated columns to export, e.g. name,book,page (default: all)")
+    parser.add_argument("--types", type=parse_list, default=None,
+                        help="comma separated recipe types to export (default: all)")
+    parser.add_argument("--timing", action="store_true", help="print the timing of the hot paths")
+    args = parser.parse_args(argv)
+    if args.weeks < 1:
+        parser.error("--weeks must be at least 1")
+    for column in args.columns or ():
+        if column not in MenuPlanner.arguments:
+            parser.error("unknown column {0}, expected one of {1}".format(column, ",".join(MenuPlanner.arguments)))
+
+    if instruments.configure() or args.timing:
+        instruments.add_sink(lambda line: print(line, file=sys.stderr))
+        instruments.enable()
+    planner = MenuPlanner()
+    if args.import_file is not None or args.export is not None:
+        rejected = []
+        if args.import_file is not None:
+            status, msg = planner.import_into_database(args.import_file, args.database, rejected=rejected)
+        else:
+            status, msg = planner.export_database(args.database, args.export, args.columns, args.types)
+        for line in rejected:
+            print(line, file=sys.stderr)
+        print(msg, file=sys.stderr)
+        planner.close_database()
+        instruments.flush()
+        # rejected rows fail the import, even if the valid ones were stored
+        return 0 if status and len(rejected) == 0 else 1
+    status, msg = planner.load_data(args.database, "DB")
+    print(msg, file=sys.stderr)
+    if not status:
+        planner.close_database()
+        return 1
+    menu = planner.plan(args.start or planner.current_date, args.weeks)
+    if args.output == "-":
+        planner.write_menu(menu, sys.stdout, args.format)
+    else:
+        with open(args.output, "w", newline="", encoding="utf-8") as output:
+            planner.write_menu(menu, output, args.format)
+    if args.save and planner.unsaved:
+        status, msg = planner.save_data(args.database, "DB")
+        print(msg, file=sys.stderr)
+    planner.close_database()
+    instruments.flush()
+    return 0 if status else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
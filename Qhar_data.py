@@ -13,101 +13,55 @@
 # You should have received a copy of the GNU General Public License
 # along with Qhar.  If not, see <http://www.gnu.org/licenses/>.
 
-from PyQt4.QtCore import *
 from Qhar_files import *
-from random import shuffle
-from Qhar_settings import Settings
-import hashlib
-
-
-class RecipeItem(Settings):
+from Qhar_validation import validate_row, sql_value, BulkValidator
+from Qhar_snapshot import SnapshotCache
+from Qhar_journal import ChangeJournal
+from Qhar_instrument import instruments
+from Qhar_planner import assign_times
+import sqlite3
+from random import randrange
+from bisect import bisect_left, bisect_right, insort
+from collections import OrderedDict
+from Qhar_settings import Schema, Calendar, Settings
+
+
+class RecipeItem(Schema, Calendar):
     """"This class is used to store the recipe item. It also serves to
-    check the items before adding them to recipe list"""
-    # TODO convert class to proper dict
+    check the items before adding them to recipe list. The schema is shared,
+    every item only stores its values and state in slots."""
     # TODO evaluate arguments @ __setitem__
     # TODO __iter__, __contains__ ...
+    __slots__ = ("values", "__valid", "__sql_action", "__hash")
+
     def __init__(self, values=None, sql_action=None):
-        super(RecipeItem, self).__init__()
         self.__valid = True
         self.__sql_action = sql_action
+        # the hash is stored in the database, don't recompute it
+        self.__hash = values.pop("hash", None) if values is not None else None
         self.values = values
         self.__valid = self.check_values("all")
 
     def check_values(self, which):
         """This method serves to validate values. If which = all, all checks are performed,
-        else, only check for value_name = which get checked to save time."""
-        try:
-            if self.values is None:
-                raise ValueError
-
-            # arguments
-            for key, value in self.arguments_required.items():
-                if value and key not in self.values:
-                    raise ValueError
-                elif not value and key not in self.values:
-                    self.values[key] = None
-                else:
-                    self.values[key] = self.value_convert(key)
-
-            # errors in required arguments are fatal
-            if self.values["name"] is None or self.values["book"] is None:
-                raise ValueError
-            if self.values["page"] < 0:
-                raise ValueError
-            self.__required = {key: self.values[key] for key, value in
-                               self.arguments_required.items() if value}
-
-            # validation of optional arguments
-            if self.values["recipe_type"] is None or self.values["recipe_type"] not in self.recipe_types.values():
-                self.values["recipe_type"] = self.recipe_types["one_course_meal"]
-
-            if self.values["time_to_cook"] is None:
-                self.values["time_to_cook"] = 60
-
-            if self.values["last_cooked"] is not None:
-                date_last_cooked = self.values["last_cooked"]
-                if date_last_cooked < self.date_of_expiry[0]:
-                    # recipe has expired
-                    self.values["last_cooked"] = None
-                elif date_last_cooked >= self.date_of_expiry[0]:
-                    if self.__sql_action == "DELETE":
-                        # recipe hasn't expired, but it's set for deletion
-                        self.values["last_cooked"] = date_last_cooked.addYears(1).toString(self.date_string)
-                    else:
-                        # QDate isn't hashable, but string is
-                        self.values["last_cooked"] = date_last_cooked.toString(self.date_string)
-                else:
-                    self.values["last_cooked"] = None
-            return True
-        except ValueError:
+        else, only check for value_name = which get checked to save time. The
+        checks themselves live in Qhar_validation, so they can run without Qt."""
+        values, reason = validate_row(self.values, self.expiry_day)
+        if values is None:
             return False
-
-    def value_convert(self, key):
-        """Convert self.values[key] to datatype given in db_types"""
-        if self.values[key] is not None:
-            try:
-                if self.db_types[key] == "BOOLEAN":
-                    if self.values[key] is True:
-                        return True
-                    else:
-                        return False
-                elif self.db_types[key] == "INT":
-                    return int(self.values[key])
-                elif self.db_types[key] == "DATE":
-                    date_string = QDate.fromString(self.values[key], self.date_string)
-                    if date_string.isValid():
-                        return date_string
-                    else:
-                        raise ValueError
-                else:
-                    if len(str(self.values[key])) > 0:
-                        return str(self.values[key])
-                    else:
-                        raise ValueError
-            except Exception:
-                return None
-        else:
-            return None
+        self.values.update(values)
+        return True
+
+    @classmethod
+    def from_validated(cls, values, recipe_hash, sql_action=None):
+        """Create a recipe from values which were already checked (and hashed)
+        by Qhar_validation, e.g. in a worker process"""
+        recipe = cls.__new__(cls)
+        recipe.values = values
+        recipe.__valid = True
+        recipe.__sql_action = sql_action
+        recipe.__hash = recipe_hash
+        return recipe
 
     @property
     def sql_action(self):
@@ -122,38 +76,25 @@ class RecipeItem(Settings):
         return self.__valid
 
     @property
-    def create_sql(self):
-        """This property returns the sql statement depending on the sql_action
-        value (INSERT, DELETE or UPDATE). It defaults to None (do nothing)."""
-        if self.__sql_action == "INSERT":
-            form1 = ", ".join(["{0}".format(key) for key in self.values.keys()])
-            form2 = ", ".join([self.quote_val(val) for val in self.values.values()])
-            return "INSERT into {0} ({1}) VALUES ({2})".format(self.table_name, form1, form2)
+    def sql_params(self):
+        """This property returns the parameters for the prepared statement
+        matching the sql_action value (INSERT, DELETE or UPDATE). The values
+        are given in the order of db_types, followed by the recipe hash which
+        identifies the row. It defaults to None (do nothing)."""
+        if self.__sql_action in ("INSERT", "UPDATE"):
+            return tuple(sql_value(key, self.values[key]) for key in self.db_types) + (self.sha1_hex(),)
         elif self.__sql_action == "DELETE":
-            form1 = " AND ".join(["{0}={1}".format(key, self.quote_val(value))
-                                  for key, value in self.__required.items()])
-            return "DELETE FROM {0} WHERE {1}".format(self.table_name, form1)
-        elif self.__sql_action == "UPDATE":
-            form1 = ",".join(["{0}={1}".format(key, self.quote_val(value))
-                              for key, value in self.values.items()])
-            form2 = " AND ".join(["{0}={1}".format(key, self.quote_val(value))
-                                  for key, value in self.__required.items()])
-            return "UPDATE {0} SET {1} WHERE {2}".format(self.table_name, form1, form2)
+            return (self.sha1_hex(),)
         else:
             return None
 
-    def quote_val(self, s):
-        """Return quoted empty string if input is None else quoted string"""
-        if s is None:
-            return "''"
-        return "'"+str(s)+"'"
-
     def __eq__(self, other):
-        return frozenset(self.__required.values()) == frozenset(other.__required.values())
+        return self.sha1_hex() == other.sha1_hex()
 
     def sha1_hex(self):
-        string = "|".join(sorted(str(item) for item in self.__required.values()))
-        return hashlib.sha1(string.encode('utf-8')).hexdigest()
+        if self.__hash is None:
+            self.__hash = recipe_hash(*[self.values[key] for key in self.required])
+        return self.__hash
 
     def __getitem__(self, key):
         return self.values[key]
@@ -161,15 +102,120 @@ class RecipeItem(Settings):
     def __setitem__(self, key, value):
         self.values[key] = value
 
-    def __dict__(self):
+    def as_dict(self):
         return self.values
 
 
+class CookingTimeIndex(object):
+    """This object indexes the recipes which can still be planned by their
+    time to cook. Recipes are kept in per-minute buckets, so a random recipe
+    for a time range is picked without scanning the whole recipe list."""
+    def __init__(self):
+        self.buckets = dict()
+        self.times = []
+        self.positions = dict()
+
+    def add(self, recipe_hash, time_to_cook):
+        if recipe_hash in self.positions:
+            return
+        bucket = self.buckets.get(time_to_cook)
+        if bucket is None:
+            bucket = self.buckets[time_to_cook] = []
+            insort(self.times, time_to_cook)
+        self.positions[recipe_hash] = (time_to_cook, len(bucket))
+        bucket.append(recipe_hash)
+
+    def remove(self, recipe_hash):
+        if recipe_hash not in self.positions:
+            return
+        time_to_cook, position = self.positions.pop(recipe_hash)
+        bucket = self.buckets[time_to_cook]
+        # move the last recipe of the bucket into the hole
+        last = bucket.pop()
+        if last != recipe_hash:
+            bucket[position] = last
+            self.positions[last] = (time_to_cook, position)
+        if len(bucket) == 0:
+            del self.buckets[time_to_cook]
+            del self.times[bisect_left(self.times, time_to_cook)]
+
+    def in_range(self, minimum, maximum):
+        """Return the indexed times to cook between minimum and maximum"""
+        return self.times[bisect_left(self.times, minimum):bisect_right(self.times, maximum)]
+
+    def nearest(self, time_to_cook, tolerance):
+        """Return the indexed time to cook closest to time_to_cook, at most
+        tolerance minutes away, or None. Ties are broken randomly."""
+        position = bisect_left(self.times, time_to_cook)
+        closest = [self.times[num] for num in (position - 1, position)
+                   if 0 <= num < len(self.times) and abs(self.times[num] - time_to_cook) <= tolerance]
+        if len(closest) == 0:
+            return None
+        distance = min(abs(other - time_to_cook) for other in closest)
+        closest = [other for other in closest if abs(other - time_to_cook) == distance]
+        return closest[randrange(len(closest))]
+
+    def count(self, minimum, maximum):
+        return sum(len(self.buckets[time_to_cook]) for time_to_cook in self.in_range(minimum, maximum))
+
+    def pick(self, minimum, maximum):
+        """Remove and return a random recipe which can be cooked in minimum
+        to maximum minutes. Return None if there is no such recipe."""
+        times = self.in_range(minimum, maximum)
+        num = randrange(self.count(minimum, maximum) or 1)
+        for time_to_cook in times:
+            bucket = self.buckets[time_to_cook]
+            if num < len(bucket):
+                recipe_hash = bucket[num]
+                self.remove(recipe_hash)
+                return recipe_hash
+            num -= len(bucket)
+        return None
+
+    def clear(self):
+        self.buckets.clear()
+        del self.times[:]
+        self.positions.clear()
+
+    def __contains__(self, recipe_hash):
+        return recipe_hash in self.positions
+
+    def __len__(self):
+        return len(self.positions)
+
+
 class RecipeContainer(Settings):
     """This class is used to handle calls from dialogs of the MainWindow"""
     def __init__(self):
         super(RecipeContainer, self).__init__()
         self.recipes = dict()
+        self.dirty = {"INSERT": set(), "UPDATE": set(), "DELETE": set()}
+        self.connection = None
+        self.repository = None
+        # days (start, end) whose planned recipes are loaded in windowed mode
+        self.horizon = None
+        self.page_cache = OrderedDict()
+        self.filter = frozenset(self.recipe_types.values())
+        self.view_order = (None, False)
+        self.view_ids = []
+        # words searched for in the names and books, the view shows matches only
+        self.search_words = ()
+        self.search_limited = False
+        self.time_index = CookingTimeIndex()
+        self.planned = dict()
+        # computed plans by (start, end) of the planned days
+        self.plans = dict()
+        # secondary indexes, dicts are used as insertion ordered sets
+        self.by_type = {recipe_type: dict() for recipe_type in self.recipe_types.values()}
+        self.by_book = dict()
+        self.side_dish_of = dict()
+        # database which is completely loaded, it can be written to a snapshot
+        self.loaded_database = None
+        # changes to the recipes of the database are journaled if enabled
+        self.journal_changes = False
+        self.journal = None
+        # journaled deletions of recipes which weren't loaded yet
+        self.pending_deletes = set()
         self.__unsaved = False
 
     @property
@@ -182,18 +228,40 @@ class RecipeContainer(Settings):
             value = True
         else:
             value = False
-        self.action_Save.setEnabled(value)
-        self.action_SaveAs.setEnabled(value)
         self.__unsaved = value
+        self.unsaved_changed(value)
+
+    def unsaved_changed(self, unsaved):
+        """Called when the unsaved state changes, the user interface can
+        override it"""
+        pass
 
     # import/export
     def load_data(self, filename, handler):
         """This method imports data into recipes list. handler is either DB
         for database or FILE for file export. Loading from database clears
-        previous data."""
+        previous data and replays the changes journaled for it."""
+        ret = self.read_data(filename, handler)
+        if handler == "DB" and ret[0] and self.journal_changes:
+            num = self.open_journal(filename)
+            if num > 0:
+                ret = (True, "{0}, recovered {1} unsaved changes".format(ret[1], num))
+        return ret
+
+    def read_data(self, filename, handler):
+        """Read the recipes of a database or a file"""
         if handler == "DB":
-            handle = DatabaseHandler(filename, None)
-            self.recipes.clear()
+            connection = self.database_connection(filename)
+            self.clear_recipes()
+            snapshot = self.load_snapshot(filename)
+            if snapshot is not None:
+                return snapshot
+            if connection.exists() and connection.check_structure():
+                connection.expire(self.expiry_day)
+                repository = RecipeRepository(connection)
+                if repository.count() > self.window_threshold:
+                    return self.load_window(repository)
+            handle = DatabaseHandler(filename, None, connection)
         else:
             handle = ImportExportHandler(filename, None)
         num = 0
@@ -215,6 +283,8 @@ class RecipeContainer(Settings):
                 return True, "Imported {0} new recipes".format(num)
             else:
                 self.unsaved = False
+                self.loaded_database = filename
+                self.save_snapshot(filename)
                 return True, "Loaded {0} recipes from database".format(num)
         else:
             if handler != "DB":
@@ -222,40 +292,540 @@ class RecipeContainer(Settings):
             else:
                 return False, "No recipes were loaded"
 
-    def save_data(self, filename, handler):
+    def add_loaded(self, recipes):
+        """Add a chunk of the recipes of a database which is being loaded on
+        a worker thread and return the hashes of the new ones"""
+        added = [recipe.sha1_hex() for recipe in recipes if self.add_recipe(recipe)]
+        deleted = self.pending_deletes.intersection(added)
+        if len(deleted) > 0:
+            for recipe_hash in deleted:
+                self.mark_recipe(recipe_hash, "DELETE")
+            self.pending_deletes.difference_update(deleted)
+            added = [recipe_hash for recipe_hash in added if recipe_hash not in deleted]
+        if len(added) > 0:
+            self.invalidate_plans()
+        return added
+
+    def finish_loading(self, filename, from_snapshot=False):
+        """Called after all recipes of database filename were added with
+        add_loaded()"""
+        self.database_connection(filename)
+        self.loaded_database = filename
+        self.pending_deletes.clear()
+        if not from_snapshot and not self.unsaved:
+            self.save_snapshot(filename)
+
+    def merge_recipes(self, recipes):
+        """Add a batch of validated recipes (e.g. a chunk of an import running
+        in the background) and return the number of new recipes"""
+        num = 0
+        for recipe in recipes:
+            if self.add_recipe(recipe):
+                num += 1
+        if num > 0:
+            self.unsaved = True
+            self.invalidate_plans()
+        return num
+
+    def save_data(self, filename, handler, recipe_types=None):
         """This method exports data from recipes list. handler is either DB
-        for database or FILE for file export."""
+        for database or FILE for file export. All recipes are exported,
+        recipe_types (default: all) selects the types."""
+        if recipe_types is not None and frozenset(recipe_types) >= frozenset(self.recipe_types.values()):
+            recipe_types = None
         if handler == "DB":
-            handle = DatabaseHandler(filename, self.recipes)
+            handle = DatabaseHandler(filename, self.dirty_recipes(), self.database_connection(filename))
+        elif self.repository is not None:
+            if self.unsaved:
+                return False, "Save the changes before exporting a database opened in windowed mode"
+            return self.export_database(self.connection.filename, filename, recipe_types=recipe_types)
         else:
-            handle = ImportExportHandler(filename, self.recipes)
+            handle = ImportExportHandler(filename, self.recipes, recipe_types=recipe_types)
         for item in handle:
-            if item:
+            if item[0] and handler == "DB":
                 # data was saved, cleanup recipe list
                 self.cleanup_recipe_list()
+                self.compact_journal(filename)
+                self.invalidate_plans()
+                if self.repository is not None:
+                    self.repository.invalidate()
+                    self.page_cache.clear()
+                elif handler == "DB" and filename == self.loaded_database:
+                    self.save_snapshot(filename)
             return item
 
+    def import_into_database(self, filename, database, parallel_size=5000000, rejected=None):
+        """Import a CSV file straight into database, without loading either
+        of them into the recipe list. Recipes stored already are skipped.
+        Files of at least parallel_size bytes are validated by a process
+        pool. Lines telling why rows were rejected are appended to the list
+        rejected if it is given."""
+        handle = ImportExportHandler(filename, None)
+        errors = []
+
+        def rows():
+            for item in handle:
+                if type(item) is not dict:
+                    errors.append(item)
+                    return
+                yield item
+        validator = BulkValidator(self.expiry_day, processes=None if handle.size() >= parallel_size else 1)
+        # about 50 bytes per row
+        importer = DatabaseImporter(self.database_connection(database), expected=handle.size() // 50)
+        for item in importer.import_rows(validator.validate(rows())):
+            self.database_changed(database)
+            if rejected is not None:
+                rejected.extend(validator.report())
+            if len(errors) > 0:
+                return errors[0]
+            if item[0] and len(validator.rejected) > 0:
+                item = (True, "{0}, rejected {1} rows".format(item[1], len(validator.rejected)))
+            return item
+
+    def database_changed(self, database):
+        """Forget what was read from database after it was written to by
+        someone else than save_data()"""
+        if self.repository is not None and self.connection.filename == database:
+            self.repository.invalidate()
+            self.page_cache.clear()
+            self.invalidate_plans()
+        if self.loaded_database == database:
+            self.loaded_database = None
+
+    def open_journal(self, filename):
+        """Start journaling the changes to the recipes of database filename.
+        Changes left in the journal by a session which ended without saving
+        them are replayed first. Return the number of replayed changes."""
+        journal = ChangeJournal(filename)
+        num = 0
+        for recipe_hash, (action, values) in journal.records().items():
+            if self.replay_change(recipe_hash, action, values):
+                num += 1
+        journal.open()
+        self.journal = journal
+        return num
+
+    def replay_change(self, recipe_hash, action, values):
+        """Apply a journaled change, return False if it no longer applies"""
+        recipe = self.lookup_recipes([recipe_hash]).get(recipe_hash)
+        if action == "DELETE":
+            if recipe is None:
+                # the recipe may be in a chunk which isn't loaded yet
+                self.pending_deletes.add(recipe_hash)
+                return False
+        elif recipe is None:
+            recipe = RecipeItem(dict(values, hash=recipe_hash), None)
+            if not recipe.is_valid or recipe.sha1_hex() != recipe_hash:
+                return False
+            self.add_recipe(recipe)
+        else:
+            values, reason = validate_row(values, self.expiry_day)
+            if values is None:
+                return False
+            self.unindex_recipe(recipe_hash)
+            recipe.values.update(values)
+            self.index_recipe(recipe_hash)
+        self.mark_recipe(recipe_hash, action)
+        self.invalidate_plans()
+        return True
+
+    def journal_recipe(self, recipe_hash):
+        """Append the pending change of the recipe to the journal"""
+        if self.journal is not None:
+            recipe = self.recipes[recipe_hash]
+            self.journal.append(recipe.sql_action, recipe.sql_params)
+
+    def compact_journal(self, filename):
+        """Clear the journal after its changes were saved into database
+        filename. Saving to another database moves the journal there."""
+        if self.journal is not None and self.journal.database == filename:
+            self.journal.clear()
+        elif self.journal_changes:
+            self.close_journal()
+            # changes of an earlier session of this database were overwritten
+            ChangeJournal(filename).discard()
+            self.open_journal(filename)
+
+    def close_journal(self):
+        """Stop journaling and give up the changes which weren't saved"""
+        if self.journal is not None:
+            self.journal.discard()
+            self.journal = None
+
+    def rollback_journal(self):
+        """Stop journaling and give up the changes made since the journal
+        was opened, the replayed ones stay in it for the next session"""
+        if self.journal is not None:
+            self.journal.rollback()
+            self.journal = None
+
+    def export_database(self, database, filename, columns=None, recipe_types=None):
+        """Write the recipes of database to a CSV file straight from the
+        database, without loading them. columns (default: all) and
+        recipe_types (default: all) select what is exported."""
+        connection = self.database_connection(database)
+        if not connection.exists():
+            return False, "No such database, export aborted."
+        if not connection.check_structure():
+            return False, "Database corrupt, export aborted."
+        if recipe_types is not None and frozenset(recipe_types) >= frozenset(self.recipe_types.values()):
+            recipe_types = None
+        for item in ImportExportHandler(filename, RecipeRepository(connection), columns, recipe_types):
+            return item
+
+    def load_snapshot(self, filename):
+        """Load the recipes from the snapshot of the database if it is up to
+        date. Return None if the database has to be read."""
+        rows = SnapshotCache(filename).load(self.expiry_day)
+        if rows is None or len(rows) > self.window_threshold:
+            return None
+        for recipe_hash, values in rows:
+            self.add_recipe(RecipeItem.from_validated(values, recipe_hash))
+        self.unsaved = False
+        self.loaded_database = filename
+        return True, "Loaded {0} recipes from snapshot".format(len(rows))
+
+    def save_snapshot(self, filename):
+        """Write the recipes, which match the database after loading or saving,
+        to its snapshot"""
+        self.connection.checkpoint()
+        SnapshotCache(filename).save({recipe_hash: recipe.values for recipe_hash, recipe in self.recipes.items()},
+                                     self.expiry_day)
+
+    def load_window(self, repository):
+        """Open a large database in windowed mode. Only the recipes planned in
+        the planning window get loaded, other rows are paged out of the
+        database when they are shown or needed for planning."""
+        self.repository = repository
+        self.load_horizon(*self.planning_window)
+        self.unsaved = False
+        return True, "Opened {0} recipes in windowed mode".format(repository.count())
+
+    def load_horizon(self, start, end):
+        """Load the recipes planned from day start to end (windowed mode).
+        Days which are already loaded aren't read again."""
+        if self.horizon is None:
+            missing = [(start, end)]
+        else:
+            missing = [(start, min(end, self.horizon[0])), (max(start, self.horizon[1]), end)]
+            start, end = min(start, self.horizon[0]), max(end, self.horizon[1])
+        for first, last in missing:
+            if first < last:
+                for item in self.repository.horizon(first, last):
+                    recipe = RecipeItem(item, None)
+                    if recipe.is_valid:
+                        self.add_recipe(recipe)
+        self.horizon = (start, end)
+
+    def sample_candidates(self, empty_days):
+        """Load random unplanned recipes from the database so that every empty
+        day of the planning window has some candidates (windowed mode)"""
+        needed = dict()
+        for day in empty_days:
+            available_time = self.available_time[self.weekday(day)]
+            needed[available_time] = needed.get(available_time, 0) + 1
+        for available_time, num in needed.items():
+            if self.time_index.count(available_time-30, available_time+30) < num:
+                for item in self.repository.candidates(available_time-30, available_time+30, 2*num):
+                    recipe = RecipeItem(item, None)
+                    if recipe.is_valid:
+                        self.add_recipe(recipe)
+
+    # recipe view
+    def reset_view(self, order_by=None, descending=False):
+        """Prepare recipe_rows for the current filter and the given sort order.
+        The list of matching hashes is built here once, so paging through it
+        later is cheap."""
+        self.view_order = (order_by, descending)
+        self.page_cache.clear()
+        if len(self.search_words) > 0:
+            ranked = self.search_recipes(self.search_words)
+            # not loaded, searching doesn't change what can be planned
+            found = self.fetch_recipes(ranked)
+            # ranked, unless sorted by a column
+            self.view_ids = [recipe_id for recipe_id in ranked
+                             if recipe_id in found and found[recipe_id]["recipe_type"] in self.filter]
+        elif self.repository is None:
+            found = self.recipes
+            if self.filter >= frozenset(self.by_type):
+                self.view_ids = list(self.recipes)
+            else:
+                self.view_ids = [recipe_id for recipe_type in sorted(self.filter)
+                                 for recipe_id in self.by_type.get(recipe_type, ())]
+        else:
+            return
+        if order_by is not None:
+            # None sorts before any value
+            self.view_ids.sort(key=lambda recipe_id: (found[recipe_id][order_by] is not None,
+                                                      found[recipe_id][order_by]),
+                               reverse=descending)
+
+    def extend_view(self, recipe_ids):
+        """Append the recipes of recipe_ids which match the filter to the end
+        of the view and return their number. Return None if the view is
+        sorted or searched, it has to be reset then."""
+        if self.repository is not None or len(self.search_words) > 0 or self.view_order[0] is not None:
+            return None
+        added = [recipe_id for recipe_id in recipe_ids if self.recipes[recipe_id]["recipe_type"] in self.filter]
+        self.view_ids.extend(added)
+        # cached pages may miss side dishes of the new recipes
+        self.page_cache.clear()
+        return len(added)
+
+    def set_search(self, text):
+        """Show only the recipes whose name or book match text, an empty text
+        shows all of them again"""
+        self.search_words = tuple(text.split())
+
+    def search_recipes(self, words, limit=1000):
+        """Return the hashes of the recipes matching words, best matches
+        first. Saved recipes are found with the full text index of the
+        database, recipes which aren't saved yet are scanned. At most limit
+        hashes are returned, search_limited tells if there were more."""
+        ranked = []
+        scanned = self.recipes.keys()
+        if self.connection is not None and (self.repository is not None or self.loaded_database is not None):
+            try:
+                if self.connection.has_search():
+                    repository = self.repository if self.repository is not None else RecipeRepository(self.connection)
+                    ranked = repository.search(words, self.filter, limit)
+                    scanned = self.dirty["INSERT"]
+            except sqlite3.Error:
+                ranked = []
+        found = frozenset(ranked)
+        words = [word.lower() for word in words]
+        for recipe_id in scanned:
+            recipe = self.recipes[recipe_id]
+            text = "{0} {1}".format(recipe["name"], recipe["book"]).lower()
+            if recipe_id not in found and all(word in text for word in words):
+                ranked.append(recipe_id)
+                if len(ranked) >= limit:
+                    break
+        self.search_limited = len(ranked) >= limit
+        return ranked
+
+    def recipe_count(self):
+        """Return the number of recipes matching the filter"""
+        if self.repository is None or len(self.search_words) > 0:
+            return len(self.view_ids)
+        return self.repository.count(self.filter) + len(self.pending_recipes())
+
+    def pending_recipes(self):
+        """Return imported recipes which are not in the database yet"""
+        return [(recipe_id, self.recipes[recipe_id]) for recipe_id in sorted(self.dirty["INSERT"])
+                if self.recipes[recipe_id]["recipe_type"] in self.filter]
+
+    def recipe_page(self, offset, limit):
+        """Return (rows, side_dishes) for limit recipes matching the filter,
+        starting at offset. rows are (hash, recipe) pairs, side_dishes is a
+        dict of their side dishes. The last few pages are cached."""
+        key = (self.filter, self.view_order, offset, limit)
+        if key in self.page_cache:
+            self.page_cache.move_to_end(key)
+            return self.page_cache[key]
+        rows = self.recipe_rows(offset, limit)
+        side_dishes = self.fetch_recipes(recipe_item["side_dish_id"] for recipe_id, recipe_item in rows)
+        self.page_cache[key] = (rows, side_dishes)
+        while len(self.page_cache) > self.page_cache_size:
+            self.page_cache.popitem(last=False)
+        return rows, side_dishes
+
+    def recipe_rows(self, offset, limit):
+        """Return (hash, recipe) pairs for limit recipes matching the filter,
+        starting at offset. In windowed mode the rows are read from the
+        database."""
+        if len(self.search_words) > 0:
+            found = self.fetch_recipes(self.view_ids[offset:offset+limit])
+            return [(recipe_id, found[recipe_id]) for recipe_id in self.view_ids[offset:offset+limit]
+                    if recipe_id in found]
+        if self.repository is None:
+            return [(recipe_id, self.recipes[recipe_id]) for recipe_id in self.view_ids[offset:offset+limit]
+                    if recipe_id in self.recipes]
+        stored = self.repository.count(self.filter)
+        rows = []
+        if offset < stored:
+            for item in self.repository.page(offset, limit, self.filter, *self.view_order):
+                recipe = RecipeItem(item, None)
+                if recipe.is_valid:
+                    recipe_id = recipe.sha1_hex()
+                    # recipes which are loaded may have unsaved changes
+                    rows.append((recipe_id, self.recipes.get(recipe_id, recipe)))
+        if offset + limit > stored:
+            rows.extend(self.pending_recipes()[max(offset-stored, 0):offset+limit-stored])
+        return rows
+
+    def lookup_recipes(self, recipe_ids):
+        """Return a dict of recipes for the given hashes. In windowed mode
+        recipes which aren't loaded yet are read from the database and kept."""
+        recipe_ids = frozenset(recipe_id for recipe_id in recipe_ids if recipe_id is not None)
+        missing = [recipe_id for recipe_id in recipe_ids if recipe_id not in self.recipes]
+        if self.repository is not None and len(missing) > 0:
+            for item in self.repository.by_hash(missing):
+                recipe = RecipeItem(item, None)
+                if recipe.is_valid:
+                    self.add_recipe(recipe)
+        return {recipe_id: self.recipes[recipe_id] for recipe_id in recipe_ids if recipe_id in self.recipes}
+
+    def fetch_recipes(self, recipe_ids):
+        """Return a dict of recipes for the given hashes like lookup_recipes,
+        but recipes which aren't loaded are only read from the database (in
+        windowed mode), they aren't kept"""
+        recipe_ids = frozenset(recipe_id for recipe_id in recipe_ids if recipe_id is not None)
+        found = {recipe_id: self.recipes[recipe_id] for recipe_id in recipe_ids if recipe_id in self.recipes}
+        if self.repository is not None and len(found) < len(recipe_ids):
+            for item in self.repository.by_hash(recipe_id for recipe_id in recipe_ids if recipe_id not in found):
+                recipe = RecipeItem(item, None)
+                if recipe.is_valid:
+                    found[recipe.sha1_hex()] = recipe
+        return found
+
+    def database_connection(self, filename):
+        """Return the session connection to filename. The open connection is
+        reused as long as the same database is used."""
+        if self.connection is not None and self.connection.filename != filename:
+            self.close_database()
+        if self.connection is None:
+            self.connection = DatabaseConnection(filename)
+        return self.connection
+
+    def close_database(self):
+        """Close the session connection"""
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
     # recipe manipulation
     def add_recipe(self, recipe):
         """Mark recipe for insertion and perform the action"""
         recipe_hash = recipe.sha1_hex()
-        if recipe_hash not in self.recipes.keys():
+        if recipe_hash not in self.recipes:
             self.recipes[recipe_hash] = recipe
+            if recipe.sql_action is not None:
+                self.dirty[recipe.sql_action].add(recipe_hash)
+                self.journal_recipe(recipe_hash)
+            self.index_recipe(recipe_hash)
             return True
         else:
             return False
 
+    def index_recipe(self, recipe_hash):
+        """Add the recipe to the cooking time index if it can be planned, or
+        to the planned dates if it is planned already. Also add it to the
+        type, book and side dish indexes."""
+        recipe = self.recipes[recipe_hash]
+        if recipe["last_cooked"] is not None:
+            self.planned[recipe["last_cooked"]] = recipe_hash
+        elif recipe["recipe_type"] != self.recipe_types["side_dish"]:
+            self.time_index.add(recipe_hash, recipe["time_to_cook"])
+        self.by_type.setdefault(recipe["recipe_type"], dict())[recipe_hash] = None
+        self.by_book.setdefault(recipe["book"], dict())[recipe_hash] = None
+        if recipe["side_dish_id"] is not None:
+            self.side_dish_of.setdefault(recipe["side_dish_id"], dict())[recipe_hash] = None
+
+    def unindex_recipe(self, recipe_hash):
+        """Remove the recipe from all indexes"""
+        recipe = self.recipes[recipe_hash]
+        self.time_index.remove(recipe_hash)
+        if self.planned.get(recipe["last_cooked"]) == recipe_hash:
+            del self.planned[recipe["last_cooked"]]
+        self.by_type[recipe["recipe_type"]].pop(recipe_hash, None)
+        self.discard_from_index(self.by_book, recipe["book"], recipe_hash)
+        self.discard_from_index(self.side_dish_of, recipe["side_dish_id"], recipe_hash)
+
+    def discard_from_index(self, index, key, recipe_hash):
+        """Remove recipe_hash from index[key] and drop the key when empty"""
+        if key in index:
+            index[key].pop(recipe_hash, None)
+            if len(index[key]) == 0:
+                del index[key]
+
+    def recipes_by_type(self, recipe_type):
+        """Return the hashes of recipes of the given type"""
+        return list(self.by_type.get(recipe_type, ()))
+
+    def recipes_by_book(self, book):
+        """Return the hashes of recipes from the given book"""
+        return list(self.by_book.get(book, ()))
+
+    def main_dishes_for(self, side_dish_hash):
+        """Return the hashes of recipes which are served with the side dish"""
+        return list(self.side_dish_of.get(side_dish_hash, ()))
+
+    def set_side_dish(self, recipe_hash, side_dish_hash):
+        """Attach the side dish to the recipe and mark it for update"""
+        self.unindex_recipe(recipe_hash)
+        self.recipes[recipe_hash]["side_dish_id"] = side_dish_hash
+        self.index_recipe(recipe_hash)
+        self.mark_recipe(recipe_hash, "UPDATE")
+        self.invalidate_plans()
+
+    def set_last_cooked(self, recipe_hash, last_cooked):
+        """Plan the recipe for last_cooked (or unplan it if None) and mark it
+        for update"""
+        self.plan_recipe(recipe_hash, last_cooked)
+        self.invalidate_plans()
+
+    def plan_recipe(self, recipe_hash, last_cooked):
+        """Same as set_last_cooked, but the cached plans are kept"""
+        self.unindex_recipe(recipe_hash)
+        self.recipes[recipe_hash]["last_cooked"] = last_cooked
+        self.index_recipe(recipe_hash)
+        self.mark_recipe(recipe_hash, "UPDATE")
+
+    def invalidate_plans(self):
+        """Forget the computed plans after the recipes have changed"""
+        self.plans.clear()
+
+    def mark_recipe(self, recipe_hash, action):
+        """Set sql_action of the recipe and keep the dirty index up to date.
+        Recipes which are not in the database yet stay marked for insertion
+        when they get updated."""
+        recipe = self.recipes[recipe_hash]
+        if not (recipe.sql_action == "INSERT" and action == "UPDATE"):
+            if recipe.sql_action is not None:
+                self.dirty[recipe.sql_action].discard(recipe_hash)
+            recipe.sql_action = action
+            self.dirty[action].add(recipe_hash)
+        self.journal_recipe(recipe_hash)
+        self.unsaved = True
+
+    def dirty_recipes(self):
+        """Return the recipes which have to be written to the database"""
+        return {recipe_hash: self.recipes[recipe_hash] for hashes in self.dirty.values()
+                for recipe_hash in hashes}
+
+    def clear_recipes(self):
+        """Empty the recipe list and the dirty index and leave windowed mode"""
+        self.recipes.clear()
+        for hashes in self.dirty.values():
+            hashes.clear()
+        self.close_journal()
+        self.repository = None
+        self.horizon = None
+        self.pending_deletes.clear()
+        self.loaded_database = None
+        self.page_cache.clear()
+        self.time_index.clear()
+        self.planned.clear()
+        self.plans.clear()
+        for recipe_ids in self.by_type.values():
+            recipe_ids.clear()
+        self.by_book.clear()
+        self.side_dish_of.clear()
+
     # cleanup the recipe list
     def cleanup_recipe_list(self):
         """Cleanup the recipe list by removing sql_action UPDATE and INSERT and
-        deleting the items with sql_action DELETE"""
-        for recipe_id, recipe_item in self.recipes.items():
-            if recipe_item.sql_action == "DELETE":
-                del self.recipes[recipe_id]
-            else:
-                print(recipe_item.sql_action)
-                recipe_item.sql_action = None
-                print(recipe_item.sql_action)
+        deleting the items with sql_action DELETE. Only recipes in the dirty
+        index are visited."""
+        for recipe_id in self.dirty["DELETE"]:
+            self.unindex_recipe(recipe_id)
+            del self.recipes[recipe_id]
+        for action in ("INSERT", "UPDATE"):
+            for recipe_id in self.dirty[action]:
+                self.recipes[recipe_id].sql_action = None
+        for hashes in self.dirty.values():
+            hashes.clear()
 
     def update_recipe(self, recipe_hash, recipe):
         """This method updates a recipe already in recipes list if the hash is
@@ -267,35 +837,69 @@ class RecipeContainer(Settings):
         """This method marks recipe from recipes list for deletion"""
         pass
 
-    def select_recipes(self, randomize=True):
+    def select_recipes(self, randomize=True, start=None, end=None):
         """Invoking this method populates the table with items from the recipes
         list. First all items with last_cooked set are connected regardles of
-        avaliable time."""
-        self.recipe_map = dict.fromkeys([self.current_date.addDays(day).toString(self.date_string)
-                                         for day in range(self.date_of_expiry[0].dayOfYear() - self.current_date.dayOfYear(),
-                                                          self.date_of_expiry[1].dayOfYear() - self.current_date.dayOfYear())])
-
-        recipes_inverted = {val["last_cooked"]: key for key, val in self.recipes.items()
-                            if val["last_cooked"] is not None}
-        self.recipe_map.update(recipes_inverted)
-        recipes_randomized = [[key, val["time_to_cook"]] for key, val in
-                              self.recipes.items() if
-                              val["last_cooked"] is None and
-                              val["recipe_type"] != self.recipe_types["side_dish"]]
-        shuffle(recipes_randomized)
-        for key, value in self.recipe_map.items():
-            if value is None:
-                available_time = self.available_time[QDate.fromString(key, self.date_string).dayOfWeek()-1]
-                # select first item from recipes_randomized which is in time_to_cook
-                for num, row in enumerate(recipes_randomized):
-                    if row[1] <= available_time+30 and row[1] >= available_time-30:
-                        # update recipe_map, update_recipe, break loop
-                        self.recipe_map[key] = row[0]
-                        self.recipes[row[0]]["last_cooked"] = key
-                        self.recipes[row[0]].sql_action = "UPDATE"
-                        self.unsaved = True
-                        del recipes_randomized[num]
-                        break
+        avaliable time. Times to cook are then assigned to all empty days at
+        once, so that as many days as possible get a recipe, and every day
+        gets a random recipe of its time from the cooking time index. The
+        days from start up to end are planned, by default the planning
+        window. Days are day ordinals. The plan is kept until the recipes
+        change, so showing another week of the same window doesn't plan
+        again."""
+        if start is None:
+            start = self.planning_window[0]
+        if end is None:
+            end = self.planning_window[1]
+        if (start, end) in self.plans:
+            self.recipe_map = self.plans[(start, end)]
+            return
+        if self.repository is not None:
+            self.load_horizon(start, end)
+        self.recipe_map = {day: self.planned.get(day) for day in range(start, end)}
+        if self.repository is not None:
+            self.sample_candidates([day for day, recipe_id in self.recipe_map.items() if recipe_id is None])
+        empty_days = [day for day, recipe_id in self.recipe_map.items() if recipe_id is None]
+        times = assign_times([self.available_time[self.weekday(day)] for day in empty_days],
+                             {time_to_cook: len(recipes) for time_to_cook, recipes in self.time_index.buckets.items()})
+        for day, time_to_cook in zip(empty_days, times):
+            if time_to_cook is not None:
+                recipe_id = self.time_index.pick(time_to_cook, time_to_cook)
+                self.recipe_map[day] = recipe_id
+                self.set_last_cooked(recipe_id, day)
+        # planning changed the recipes, remember the plan afterwards
+        self.plans[(start, end)] = self.recipe_map
+
+    def replan_day(self, day, tolerance=30):
+        """Plan another recipe for day, the other days stay as they are. The
+        recipe closest to the available time is picked from the cooking time
+        index before the previous one is put back, so it isn't picked again.
+        The cached plans are updated instead of planned again. Return the
+        hash of the new recipe, or None if no other recipe fits the day."""
+        if self.repository is not None:
+            self.sample_candidates([day])
+        time_to_cook = self.time_index.nearest(self.available_time[self.weekday(day)], tolerance)
+        if time_to_cook is None:
+            return None
+        recipe_id = self.time_index.pick(time_to_cook, time_to_cook)
+        previous = self.planned.get(day)
+        self.plan_recipe(recipe_id, day)
+        if previous is not None:
+            self.plan_recipe(previous, None)
+        for (start, end), recipe_map in self.plans.items():
+            if start <= day < end:
+                recipe_map[day] = recipe_id
+        if day in self.recipe_map:
+            self.recipe_map[day] = recipe_id
+        return recipe_id
 
     def __len__(self):
-        return len(self.recipes)
\ No newline at end of file
+        if self.repository is not None:
+            return self.repository.count() + len(self.dirty["INSERT"])
+        return len(self.recipes)
+
+
+instruments.register(RecipeItem, "check_values", aggregate=True)
+instruments.register(BulkValidator, "validate")
+instruments.register(RecipeContainer, "select_recipes", rows=lambda container: len(container.recipe_map))
+instruments.register(RecipeContainer, "replan_day")
@@ -14,17 +14,202 @@
 # along with Qhar.  If not, see <http://www.gnu.org/licenses/>.
 
 import csv
+import itertools
 import sqlite3
 import os.path
-from PyQt4.QtCore import *
+import time
+from datetime import date
+from pathlib import Path
 from Qhar_settings import *
+from Qhar_validation import recipe_hash, csv_value, sql_value
+from Qhar_bloom import BloomFilter
+from Qhar_instrument import instruments
 
 
-class DatabaseHandler(Settings):
-    def __init__(self, filename=None, contents=None):
+class DatabaseConnection(Schema):
+    """This object keeps a single sqlite3 connection to the database in use
+    open for the whole session. The structure check is done only once per
+    connection and the connection is tuned for many small saves."""
+    def __init__(self, filename):
+        super(DatabaseConnection, self).__init__()
+        self.filename = filename
+        self.cache_size = 20000  # KiB
+        self.__db = None
+        self.__structure = None
+
+    @property
+    def db(self):
+        """Return the open connection, connecting on first use. Transactions
+        are handled explicitly (isolation_level=None)."""
+        if self.__db is None:
+            self.__db = sqlite3.connect(self.filename, isolation_level=None)
+            self.__db.execute("PRAGMA journal_mode=WAL")
+            self.__db.execute("PRAGMA synchronous=NORMAL")
+            self.__db.execute("PRAGMA cache_size=-{0}".format(self.cache_size))
+            self.__db.execute("PRAGMA temp_store=MEMORY")
+            self.__db.create_function("recipe_hash", len(self.required), recipe_hash)
+        return self.__db
+
+    def exists(self):
+        return Path(self.filename).exists()
+
+    def table_structure(self):
+        """Return the column names of the recipes table"""
+        cursor = self.db.cursor()
+        cursor.row_factory = sqlite3.Row
+        row = cursor.execute("PRAGMA table_info({0})".format(self.table_name))
+        return frozenset([item["name"] for item in row])
+
+    def check_structure(self):
+        """Check if the database we are writing in/reading from has correct
+        structure (e.g. it has all columns our program uses). Databases with
+        an older schema are migrated first. The result is cached until
+        invalidate() is called."""
+        if self.__structure is None:
+            try:
+                if not frozenset(self.arguments.keys()).issubset(self.table_structure()):
+                    self.__structure = False
+                else:
+                    self.__structure = self.migrate()
+            except Exception:
+                return False
+        return self.__structure
+
+    def create_structure(self):
+        """Create the recipes table and its indexes in the current schema"""
+        db = self.db
+        columns = ", ".join(["{0} {1}".format(key, val) for key, val in self.db_types.items()])
+        db.execute("BEGIN")
+        db.execute("CREATE TABLE {0} (id INTEGER PRIMARY KEY, {1}, hash VARCHAR)".format(self.table_name, columns))
+        self.create_indexes(db)
+        self.create_search(db)
+        db.execute("PRAGMA user_version = {0}".format(self.schema_version))
+        db.execute("COMMIT")
+        self.invalidate()
+
+    def create_indexes(self, db):
+        db.execute("CREATE UNIQUE INDEX IF NOT EXISTS {0}_hash ON {0} (hash)".format(self.table_name))
+        db.execute("CREATE INDEX IF NOT EXISTS {0}_last_cooked ON {0} (last_cooked)".format(self.table_name))
+        db.execute("CREATE INDEX IF NOT EXISTS {0}_recipe_type ON {0} (recipe_type)".format(self.table_name))
+
+    def create_search(self, db):
+        """Create the full text index of the names and books. Triggers keep
+        it up to date whenever recipes are saved. Without FTS5 in the sqlite
+        library the database works without it."""
+        try:
+            db.execute("SAVEPOINT search")
+            db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS {0} USING fts5(name, book, content='{1}', "
+                       "content_rowid='id', tokenize='unicode61 remove_diacritics 2')".format(
+                           self.search_table, self.table_name))
+        except sqlite3.OperationalError:
+            db.execute("ROLLBACK TO search")
+            db.execute("RELEASE search")
+            return False
+        db.execute("CREATE TRIGGER IF NOT EXISTS {0}_insert AFTER INSERT ON {1} BEGIN "
+                   "INSERT INTO {0} (rowid, name, book) VALUES (new.id, new.name, new.book); END".format(
+                       self.search_table, self.table_name))
+        db.execute("CREATE TRIGGER IF NOT EXISTS {0}_delete AFTER DELETE ON {1} BEGIN "
+                   "INSERT INTO {0} ({0}, rowid, name, book) VALUES ('delete', old.id, old.name, old.book); END".format(
+                       self.search_table, self.table_name))
+        db.execute("CREATE TRIGGER IF NOT EXISTS {0}_update AFTER UPDATE OF name, book ON {1} BEGIN "
+                   "INSERT INTO {0} ({0}, rowid, name, book) VALUES ('delete', old.id, old.name, old.book); "
+                   "INSERT INTO {0} (rowid, name, book) VALUES (new.id, new.name, new.book); END".format(
+                       self.search_table, self.table_name))
+        db.execute("RELEASE search")
+        return True
+
+    def has_search(self):
+        """Return True if the database has the full text index"""
+        return self.db.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (self.search_table,)).fetchone() is not None
+
+    def migrate(self):
+        """Upgrade the database schema in place, one version at a time. The
+        schema version is kept in PRAGMA user_version. Return False if the
+        database couldn't be upgraded."""
+        db = self.db
+        version = db.execute("PRAGMA user_version").fetchone()[0]
+        if version > self.schema_version:
+            # written by a newer version of the program
+            return False
+        if version == self.schema_version:
+            return True
+        try:
+            db.execute("BEGIN")
+            for target in range(max(version, 1) + 1, self.schema_version + 1):
+                getattr(self, "migrate_v{0}".format(target))(db)
+            db.execute("PRAGMA user_version = {0}".format(self.schema_version))
+            db.execute("COMMIT")
+            return True
+        except sqlite3.Error:
+            if db.in_transaction:
+                db.execute("ROLLBACK")
+            return False
+
+    def migrate_v2(self, db):
+        """Store the recipe hash in an indexed column and index the columns
+        used for planning and filtering. Duplicated recipes are dropped."""
+        if "hash" not in self.table_structure():
+            db.execute("ALTER TABLE {0} ADD COLUMN hash VARCHAR".format(self.table_name))
+        db.execute("UPDATE {0} SET hash = recipe_hash({1})".format(self.table_name, ", ".join(self.required)))
+        db.execute("DELETE FROM {0} WHERE id NOT IN (SELECT MIN(id) FROM {0} GROUP BY hash)".format(self.table_name))
+        self.create_indexes(db)
+
+    def migrate_v3(self, db):
+        """Store the last cooked dates as ISO dates, so they sort and compare
+        as text"""
+        db.execute("UPDATE {0} SET last_cooked = NULL WHERE last_cooked = ''".format(self.table_name))
+        db.execute("UPDATE {0} SET last_cooked = substr(last_cooked, 7, 4) || '-' || substr(last_cooked, 4, 2) "
+                   "|| '-' || substr(last_cooked, 1, 2) WHERE last_cooked LIKE '__.__.____'".format(self.table_name))
+
+    def expire(self, expiry):
+        """Clear the last cooked dates before the day ordinal expiry, so the
+        recipes can be planned again. Return the number of cleared rows."""
+        db = self.db
+        try:
+            db.execute("BEGIN")
+            cursor = db.execute("UPDATE {0} SET last_cooked = NULL WHERE last_cooked < ?".format(self.table_name),
+                                (date.fromordinal(expiry).isoformat(),))
+            db.execute("COMMIT")
+            return cursor.rowcount
+        except sqlite3.Error:
+            if db.in_transaction:
+                db.execute("ROLLBACK")
+            return 0
+
+    def migrate_v4(self, db):
+        """Index the names and books for searching"""
+        if self.create_search(db):
+            db.execute("INSERT INTO {0} ({0}) VALUES ('rebuild')".format(self.search_table))
+
+    def checkpoint(self):
+        """Move the changes in the write-ahead log into the database file and
+        empty the log"""
+        if self.__db is not None:
+            try:
+                self.__db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            except sqlite3.Error:
+                pass
+
+    def invalidate(self):
+        """Forget the result of the structure check"""
+        self.__structure = None
+
+    def close(self):
+        if self.__db is not None:
+            self.__db.close()
+            self.__db = None
+        self.__structure = None
+
+
+class DatabaseHandler(Schema):
+    def __init__(self, filename=None, contents=None, connection=None):
         super(DatabaseHandler, self).__init__()
-        self.__filename = filename
         self.__contents = contents
+        # a handler without a session connection uses its own and closes it
+        self.__owns_connection = connection is None
+        if connection is None:
+            connection = DatabaseConnection(filename)
+        self.__connection = connection
 
     def __iter__(self):
         if self.__contents is None:
@@ -34,24 +219,14 @@ class DatabaseHandler(Settings):
             # write
             return self.save_database()
 
+    def contents_count(self):
+        """Return the number of recipes to write"""
+        return len(self.__contents) if self.__contents is not None else 0
+
     def check_database_structure(self):
         """Check if the database we are writing in/reading from has correct
         structure (e.g. it has all columns our program uses)"""
-        db = None
-        try:
-            db = sqlite3.connect(self.__filename)
-            db.row_factory = sqlite3.Row
-            row = db.execute("PRAGMA table_info({0})".format(self.table_name))
-            table_structure = frozenset([item["name"] for item in row])
-            if frozenset(self.arguments.keys()).issubset(table_structure):
-                return True
-            else:
-                return False
-        except Exception:
-            return False
-        finally:
-            if db is not None:
-                db.close()
+        return self.__connection.check_structure()
 
     def dict_factory(self, cursor, row):
         """This method is used to return db result as a dictionary"""
@@ -60,88 +235,364 @@ class DatabaseHandler(Settings):
             d[col[0]] = row[idx]
         return d
 
+    def close(self):
+        """Close the connection if it isn't shared with the session"""
+        if self.__owns_connection:
+            self.__connection.close()
+
     def load_database(self):
         """Try to load the database (if it exists and populate the self.recipes
         list. Return message upon/success failure"""
-        if not QFileInfo(self.__filename).exists():
-            yield False, "No such database, loading aborted."
-        elif not self.check_database_structure():
-            yield False, "Database corrupt, loading aborted."
-        else:
-            db = None
-            try:
-                db = sqlite3.connect(self.__filename)
-                db.row_factory = self.dict_factory
-                for dict_result in db.execute("SELECT * FROM {0}".format(self.table_name)):
-                    yield dict_result
-            except Exception:
-                yield False, "Something went wrong when loading the database."
-            finally:
-                if db is not None:
-                    db.close()
+        try:
+            if not self.__connection.exists():
+                yield False, "No such database, loading aborted."
+            elif not self.check_database_structure():
+                yield False, "Database corrupt, loading aborted."
+            else:
+                try:
+                    cursor = self.__connection.db.cursor()
+                    cursor.row_factory = self.dict_factory
+                    for dict_result in cursor.execute("SELECT {0}, hash FROM {1}".format(
+                            ", ".join(self.db_types.keys()), self.table_name)):
+                        yield dict_result
+                except Exception:
+                    yield False, "Something went wrong when loading the database."
+        finally:
+            self.close()
+
+    def sql_statements(self):
+        """Return prepared INSERT, UPDATE and DELETE statements. Parameters
+        are bound in the order given by RecipeItem.sql_params"""
+        columns = list(self.db_types.keys())
+        # recipes which are already stored are skipped on insert
+        return {"INSERT": "INSERT OR IGNORE INTO {0} ({1}, hash) VALUES ({2}, ?)".format(
+                    self.table_name, ", ".join(columns), ", ".join(["?"] * len(columns))),
+                "UPDATE": "UPDATE {0} SET {1} WHERE hash=?".format(
+                    self.table_name, ", ".join(["{0}=?".format(key) for key in columns])),
+                "DELETE": "DELETE FROM {0} WHERE hash=?".format(self.table_name)}
 
     def save_database(self):
         """This method saves the data into the database. It's used to insert/update
-        and delete records. """
-        if not QFileInfo(self.__filename).exists():
-            if not self.create_database():
-                yield False, "Could not create database, saving aborted."
-        if QFileInfo(self.__filename).exists():
-            if not self.check_database_structure():
-                yield False, "Database corrupt, saving aborted."
-            elif len(self.__contents) == 0:
-                yield False, "Nothing to save."
-            else:
-                db = None
-                try:
-                    db = sqlite3.connect(self.__filename)
+        and delete records. Pending rows are grouped by sql_action and written
+        with executemany inside a single transaction."""
+        try:
+            if not self.__connection.exists():
+                if not self.create_database():
+                    yield False, "Could not create database, saving aborted."
+            if self.__connection.exists():
+                if not self.check_database_structure():
+                    yield False, "Database corrupt, saving aborted."
+                elif len(self.__contents) == 0:
+                    yield False, "Nothing to save."
+                else:
+                    statements = self.sql_statements()
+                    batches = {action: [] for action in statements}
                     for item in self.__contents.values():
-                        if item.create_sql is not None:
-                            db.execute(item.create_sql)
-                    db.commit()
-                    yield True, "Saving was successfull"
-                except KeyError:
-                    yield False, "Saving to database failed!"
-                finally:
-                    if db is not None:
-                        db.close()
+                        if item.sql_action in batches:
+                            batches[item.sql_action].append(item.sql_params)
+                    db = self.__connection.db
+                    try:
+                        start = time.perf_counter()
+                        db.execute("BEGIN")
+                        # rows actually changed, recipes already stored are ignored on insert
+                        changed = {action: 0 for action in statements}
+                        for action, rows in batches.items():
+                            if len(rows) > 0:
+                                changed[action] = db.executemany(statements[action], rows).rowcount
+                        db.execute("COMMIT")
+                        elapsed = time.perf_counter() - start
+                        num = sum(len(rows) for rows in batches.values())
+                        yield True, "Saving was successfull: {0} inserted, {1} updated, {2} deleted ({3:.0f} rows/s)".format(
+                            changed["INSERT"], changed["UPDATE"], changed["DELETE"],
+                            num / elapsed if elapsed > 0 else num)
+                    except sqlite3.Error:
+                        if db.in_transaction:
+                            db.execute("ROLLBACK")
+                        yield False, "Saving to database failed!"
+        finally:
+            self.close()
 
     def create_database(self):
         """This method creates a database if the file doesn't exist yet"""
-        db = None
         try:
-            db = sqlite3.connect(self.__filename)
-            sql = ", ".join(["{0} {1}".format(key, val) for key, val in self.db_types.items()])
-            db.execute("CREATE TABLE {0} (id INTEGER PRIMARY KEY, {1})".format(self.table_name, sql))
-            db.commit()
+            self.__connection.create_structure()
             return True
         except Exception:
             return False
-        finally:
-            if db is not None:
-                db.close()
 
 
-class ImportExportHandler(Settings):
-    def __init__(self, filename=None, contents=None):
+class DatabaseImporter(Schema):
+    """This object inserts validated rows straight into a database, without
+    loading its recipes. Rows whose hash is stored already are skipped: a
+    Bloom filter built from the hash column rules out most rows at once and
+    only the possible duplicates are looked up. New rows are inserted in
+    batches, every batch in its own transaction."""
+    def __init__(self, connection, batch_size=10000, expected=0):
+        super(DatabaseImporter, self).__init__()
+        self.connection = connection
+        self.batch_size = batch_size
+        # number of new rows expected, to size the Bloom filter
+        self.expected = expected
+        self.known = None
+        self.rows = 0
+        self.inserted = 0
+
+    def load_hashes(self):
+        """Build the Bloom filter of the stored hashes"""
+        db = self.connection.db
+        count = db.execute("SELECT COUNT(*) FROM {0}".format(self.table_name)).fetchone()[0]
+        self.known = BloomFilter(count + self.expected)
+        cursor = db.execute("SELECT hash FROM {0}".format(self.table_name))
+        while True:
+            rows = cursor.fetchmany(10000)
+            if len(rows) == 0:
+                break
+            self.known.update(row[0] for row in rows)
+
+    def stored(self, hashes):
+        """Return the hashes which are stored in the database"""
+        found = set()
+        for start in range(0, len(hashes), 500):
+            part = hashes[start:start+500]
+            found.update(row[0] for row in self.connection.db.execute(
+                "SELECT hash FROM {0} WHERE hash IN ({1})".format(self.table_name, ", ".join(["?"] * len(part))),
+                part))
+        return found
+
+    def write_batch(self, batch):
+        """Insert the new rows of batch, a list of (values, hash)"""
+        new = dict()
+        possible = []
+        for values, row_hash in batch:
+            if row_hash in new:
+                continue
+            if row_hash in self.known:
+                possible.append(row_hash)
+            new[row_hash] = values
+        for row_hash in self.stored(possible):
+            del new[row_hash]
+        columns = list(self.db_types.keys())
+        db = self.connection.db
+        db.execute("BEGIN")
+        cursor = db.executemany("INSERT OR IGNORE INTO {0} ({1}, hash) VALUES ({2}, ?)".format(
+                                    self.table_name, ", ".join(columns), ", ".join(["?"] * len(columns))),
+                                (tuple(sql_value(key, values[key]) for key in columns) + (row_hash,)
+                                 for row_hash, values in new.items()))
+        db.execute("COMMIT")
+        self.inserted += max(cursor.rowcount, 0)
+        self.known.update(new)
+
+    def import_rows(self, results, progress=None):
+        """Insert the results of BulkValidator.validate(). progress is called
+        with the number of rows written after every batch."""
+        db = self.connection.db
+        try:
+            if len(self.connection.table_structure()) == 0:
+                self.connection.create_structure()
+            elif not self.connection.check_structure():
+                yield False, "Database corrupt, import aborted."
+                return
+            self.load_hashes()
+            batch = []
+            for num, values, row_hash in results:
+                batch.append((values, row_hash))
+                if len(batch) == self.batch_size:
+                    self.write_batch(batch)
+                    self.rows += len(batch)
+                    batch = []
+                    if progress is not None:
+                        progress(self.rows)
+            if len(batch) > 0:
+                self.write_batch(batch)
+                self.rows += len(batch)
+            yield True, "Imported {0} new recipes, skipped {1} already stored".format(
+                self.inserted, self.rows - self.inserted)
+        except sqlite3.Error:
+            if db.in_transaction:
+                db.execute("ROLLBACK")
+            yield False, "Import into database failed after {0} new recipes".format(self.inserted)
+
+
+class RecipeRepository(Schema):
+    """This object pages recipe rows out of the database on demand. It is
+    used instead of loading the whole table when the database is large.
+    Sorting and filtering are done in SQL, rows are returned as dicts."""
+    def __init__(self, connection):
+        super(RecipeRepository, self).__init__()
+        self.connection = connection
+        self.__count = dict()
+
+    def dict_factory(self, cursor, row):
+        """This method is used to return db result as a dictionary"""
+        return {col[0]: row[idx] for idx, col in enumerate(cursor.description)}
+
+    def select(self, where="", params=(), tail="", tail_params=()):
+        """Run a SELECT on the recipes table and yield rows as dicts"""
+        cursor = self.connection.db.cursor()
+        cursor.row_factory = self.dict_factory
+        sql = "SELECT {0}, hash FROM {1}".format(", ".join(self.db_types.keys()), self.table_name)
+        if where:
+            sql += " WHERE " + where
+        return cursor.execute(sql + " " + tail, tuple(params) + tuple(tail_params))
+
+    def type_filter(self, recipe_types):
+        """Return the WHERE clause and parameters for a recipe type filter.
+        Recipes without a type count as one course meals."""
+        if recipe_types is None or frozenset(recipe_types) >= frozenset(self.recipe_types.values()):
+            return "", ()
+        recipe_types = sorted(recipe_types)
+        where = "recipe_type IN ({0})".format(", ".join(["?"] * len(recipe_types)))
+        if self.recipe_types["one_course_meal"] in recipe_types:
+            where = "({0} OR recipe_type IS NULL)".format(where)
+        return where, recipe_types
+
+    def count(self, recipe_types=None):
+        """Return the number of recipes matching the filter. Counts are cached
+        until invalidate() is called."""
+        where, params = self.type_filter(recipe_types)
+        if where not in self.__count or self.__count[where][0] != params:
+            sql = "SELECT COUNT(*) FROM {0}".format(self.table_name)
+            if where:
+                sql += " WHERE " + where
+            self.__count[where] = (params, self.connection.db.execute(sql, params).fetchone()[0])
+        return self.__count[where][1]
+
+    def invalidate(self):
+        """Forget cached counts after the table was written to"""
+        self.__count.clear()
+
+    def page(self, offset, limit, recipe_types=None, order_by="name", descending=False):
+        """Return limit rows starting at offset, sorted by order_by"""
+        if order_by not in self.db_types:
+            order_by = "name"
+        where, params = self.type_filter(recipe_types)
+        direction = "DESC" if descending else "ASC"
+        return self.select(where, params, "ORDER BY {0} {1}, id {1} LIMIT ? OFFSET ?".format(order_by, direction),
+                           (limit, offset))
+
+    def export(self, columns, recipe_types=None):
+        """Return a cursor over the given columns of the recipes matching the
+        filter, converted like they are written to CSV files. Rows are
+        fetched from the database while they are read."""
+        expressions = ["strftime('{0}', {1})".format(self.date_format, key) if self.db_types[key] == "DATE" else key
+                       for key in columns]
+        where, params = self.type_filter(recipe_types)
+        sql = "SELECT {0} FROM {1}".format(", ".join(expressions), self.table_name)
+        if where:
+            sql += " WHERE " + where
+        cursor = self.connection.db.cursor()
+        cursor.arraysize = 1000
+        return cursor.execute(sql + " ORDER BY id", params)
+
+    def sample(self, limit):
+        """Return a random sample of unplanned main dishes"""
+        return self.select("last_cooked IS NULL AND COALESCE(recipe_type, '') != ?", (self.recipe_types["side_dish"],),
+                           "ORDER BY RANDOM() LIMIT ?", (limit,))
+
+    def search(self, words, recipe_types=None, limit=1000):
+        """Return the hashes of the recipes whose name or book has words
+        starting with all of words, best matches first"""
+        query = " ".join('"{0}"*'.format(word.replace('"', '""')) for word in words)
+        where, params = self.type_filter(recipe_types)
+        sql = ("SELECT {1}.hash FROM {0} JOIN {1} ON {1}.id = {0}.rowid WHERE {0} MATCH ?".format(
+            self.search_table, self.table_name))
+        if where:
+            sql += " AND " + where
+        return [row[0] for row in self.connection.db.execute(sql + " ORDER BY {0}.rank LIMIT ?".format(
+            self.search_table), (query,) + tuple(params) + (limit,))]
+
+    def horizon(self, start, end):
+        """Return recipes which were cooked or are planned from the day ordinal
+        start up to end"""
+        return self.select("last_cooked >= ? AND last_cooked < ?",
+                           (date.fromordinal(start).isoformat(), date.fromordinal(end).isoformat()))
+
+    def candidates(self, minimum, maximum, limit):
+        """Return a random sample of unplanned main dishes which can be cooked
+        in minimum to maximum minutes. Expired dates are cleared when the
+        database is opened, so unplanned recipes have none."""
+        return self.select("last_cooked IS NULL AND "
+                           "COALESCE(recipe_type, '') != ? AND "
+                           "COALESCE(time_to_cook, 60) BETWEEN ? AND ?",
+                           (self.recipe_types["side_dish"], minimum, maximum),
+                           "ORDER BY RANDOM() LIMIT ?", (limit,))
+
+    def by_hash(self, hashes):
+        """Return the recipes with the given hashes"""
+        hashes = list(hashes)
+        if len(hashes) == 0:
+            return iter(())
+        return self.select("hash IN ({0})".format(", ".join(["?"] * len(hashes))), hashes)
+
+
+class ImportExportHandler(Schema):
+    """This object reads and writes CSV files. contents to write are either
+    the recipe list (a dict of RecipeItems) or a RecipeRepository, whose rows
+    are streamed from the database. columns and recipe_types select what is
+    written."""
+    def __init__(self, filename=None, contents=None, columns=None, recipe_types=None):
         super(ImportExportHandler, self).__init__()
         self.__filename = "{0}".format(filename)
         self.__contents = contents
+        self.columns = list(columns) if columns is not None else list(self.arguments)
+        self.recipe_types = recipe_types
+        self.rows_written = 0
+        self.__csvfile = None
+        self.__bytes_read = 0
 
     def __iter__(self):
         if self.__contents is not None:
             # write
             if os.path.splitext(self.__filename)[1] == ".csv":
-                return self.write_csv()
+                return self.write_csv(self.export_rows())
         else:
             # read
             if os.path.splitext(self.__filename)[1] == ".csv":
                 return self.read_csv()
+        return self.unsupported()
+
+    def unsupported(self):
+        yield False, "Unsupported file format, only {0} files can be used".format(self.formats())
+
+    def contents_count(self):
+        """Return the number of recipes to write"""
+        if self.__contents is None:
+            return 0
+        if isinstance(self.__contents, RecipeRepository):
+            return self.__contents.count(self.recipe_types)
+        return len(self.__contents)
+
+    def export_rows(self):
+        """Return the rows to write as tuples in the order of columns"""
+        if any(key not in self.arguments for key in self.columns):
+            return None
+        if isinstance(self.__contents, RecipeRepository):
+            return self.__contents.export(self.columns, self.recipe_types)
+        recipes = self.__contents.values()
+        if self.recipe_types is not None:
+            recipes = (recipe for recipe in recipes if recipe["recipe_type"] in self.recipe_types)
+        return (tuple(csv_value(key, recipe[key]) for key in self.columns) for recipe in recipes)
 
     @staticmethod
     def formats():
         return "*.csv"
 
+    def size(self):
+        """Return the size of the file in bytes"""
+        try:
+            return os.path.getsize(self.__filename)
+        except OSError:
+            return 0
+
+    @property
+    def bytes_read(self):
+        """Return the bytes of the file read so far, used to report the
+        progress of imports. Characters aren't bytes in non-ASCII files, so
+        the position of the binary file is used."""
+        if self.__csvfile is not None and not self.__csvfile.closed:
+            self.__bytes_read = self.__csvfile.buffer.tell()
+        return self.__bytes_read
+
     def read_csv(self):
         """This method reads the CSV file one line at at time"""
         csvfile = None
@@ -150,49 +601,61 @@ class ImportExportHandler(Settings):
         optional_arguments = frozenset([value for key, value in self.arguments.items()
                                         if self.arguments_required[key] is False])
         try:
-            with open(self.__filename, 'r') as csvfile:
+            with open(self.__filename, 'r', newline="", encoding="utf-8") as csvfile:
+                self.__csvfile = csvfile
                 csv_reader = csv.reader(csvfile, delimiter='\t', quotechar='|')
                 header = next(csv_reader)
                 if not required_arguments.issubset(frozenset(header)):
                     yield False, "Invalid header in CSV file"
-                else:
-                    header_map = dict()
-                    for num, item in enumerate(header):
-                        if item in optional_arguments or item in required_arguments:
-                            header_map[item.lower().replace(" ", "_")] = num
+                    return
+                header_map = dict()
+                for num, item in enumerate(header):
+                    if item in optional_arguments or item in required_arguments:
+                        header_map[item.lower().replace(" ", "_")] = num
                 for item in csv_reader:
                     output = dict()
                     for map_key, map_value in header_map.items():
-                        # drop empty cells
-                        if len(item[map_value]) > 0:
+                        # drop empty and missing cells
+                        if map_value < len(item) and len(item[map_value]) > 0:
                             output[map_key] = item[map_value]
                     yield output
         except Exception:
             yield False, "Failed to load CSV file"
         finally:
             if csvfile is not None:
+                self.__bytes_read = self.size()
                 csvfile.close()
+            self.__csvfile = None
 
-    def write_csv(self):
-        """This method writes the recipes list into a CSV file"""
-        csvfile = None
-        header = {argument.lower().replace(" ", "_"): argument for argument in
-                  self.required_arguments+self.optional_arguments}
-        argument_list = header.keys()
-        if len(self.__contents) == 0:
-            yield False, "Nothing to export."
+    def write_csv(self, rows):
+        """This method writes rows into a CSV file in the format read by
+        read_csv. Rows are written in batches through a buffered file, so
+        memory use doesn't grow with the number of rows."""
+        if rows is None:
+            yield False, "Unknown column, export aborted."
+            return
         try:
-            with open(self.__filename, "wb") as csvfile:
-                w = csv.DictWriter(csvfile, argument_list,
-                                   delimiter='\t', quotechar='|')
-                num = 0
-                w.writerow(header)
-                for val in self.__contents.values():
-                    w.writerow(val.__dict__())
-                    num += 1
-            yield True, "Exported {0} recipes".format(num)
-        except:
+            rows = iter(rows)
+            batch = list(itertools.islice(rows, 1000))
+            # the file isn't created if there's nothing to write
+            if len(batch) == 0:
+                yield False, "Nothing to export."
+                return
+            with open(self.__filename, "w", newline="", encoding="utf-8", buffering=1024*1024) as csvfile:
+                writer = csv.writer(csvfile, delimiter='\t', quotechar='|')
+                writer.writerow([self.arguments[key] for key in self.columns])
+                while len(batch) > 0:
+                    writer.writerows(batch)
+                    self.rows_written += len(batch)
+                    batch = list(itertools.islice(rows, 1000))
+            yield True, "Exported {0} recipes".format(self.rows_written)
+        except (OSError, sqlite3.Error, csv.Error, ValueError):
             yield False, "Failed to write CSV file"
-        finally:
-            if csvfile is not None:
-                csvfile.close()
\ No newline at end of file
+
+
+instruments.register(DatabaseHandler, "load_database")
+instruments.register(DatabaseHandler, "save_database", rows=DatabaseHandler.contents_count)
+instruments.register(DatabaseImporter, "import_rows", rows=lambda importer: importer.rows)
+instruments.register(RecipeRepository, "search")
+instruments.register(ImportExportHandler, "read_csv")
+instruments.register(ImportExportHandler, "write_csv", rows=lambda handle: handle.rows_written)
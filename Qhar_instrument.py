@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+# This file is part of Qhar.
+# Qhar is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# Qhar is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with Qhar.  If not, see <http://www.gnu.org/licenses/>.
+
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+
+
+class Span(object):
+    """Timing of one call"""
+    __slots__ = ("name", "start", "seconds", "rows", "peak")
+
+    def __init__(self, name):
+        self.name = name
+        self.start = time.perf_counter()
+        self.seconds = None
+        self.rows = None
+        self.peak = None
+
+    def summary(self):
+        line = "{0}: {1:.1f} ms".format(self.name, 1000 * self.seconds)
+        if self.rows is not None:
+            line += ", {0} rows".format(self.rows)
+            if self.seconds > 0:
+                line += " ({0:.0f} rows/s)".format(self.rows / self.seconds)
+        if self.peak is not None:
+            line += ", peak {0:.1f} MiB allocated".format(self.peak / 2**20)
+        return line
+
+
+class Instrumentation(object):
+    """This object times the hot paths of the program. Methods are registered
+    with register() and are only replaced by timing wrappers while the
+    instrumentation is enabled, so it costs nothing when it is disabled.
+
+    Methods called for every recipe are registered with aggregate=True:
+    their calls are summed up and reported when the outermost timed call
+    ends. Peak allocations are measured for outermost calls only."""
+    def __init__(self):
+        self.enabled = False
+        self.memory = False
+        self.sinks = []
+        self.registered = []
+        self.originals = dict()
+        self.totals = dict()
+        self.depth = threading.local()
+        self.trace = None
+        self.trace_file = None
+        self.origin = time.perf_counter()
+
+    def register(self, owner, name, rows=None, aggregate=False):
+        """Time owner.name. rows is a function returning the number of rows
+        processed by the instance, by default the items yielded by
+        generators are counted."""
+        self.registered.append((owner, name, rows, aggregate))
+        if self.enabled:
+            self.wrap(owner, name, rows, aggregate)
+
+    def enable(self, memory=False):
+        """Start timing. With memory=True the peak allocations are traced
+        too, which slows the program down considerably."""
+        if self.enabled:
+            return
+        self.enabled = True
+        self.memory = memory
+        if memory:
+            import tracemalloc
+            tracemalloc.start()
+        for owner, name, rows, aggregate in self.registered:
+            self.wrap(owner, name, rows, aggregate)
+
+    def disable(self):
+        """Stop timing and restore the original methods"""
+        if not self.enabled:
+            return
+        for (owner, name), original in self.originals.items():
+            setattr(owner, name, original)
+        self.originals.clear()
+        if self.memory:
+            import tracemalloc
+            tracemalloc.stop()
+        self.enabled = False
+        self.flush()
+
+    def add_sink(self, sink):
+        """Add a function which receives a summary line for every timed call"""
+        self.sinks.append(sink)
+
+    def log_to_file(self, filename, max_bytes=1024*1024, backup_count=3):
+        """Also write the summaries to a rotating log file"""
+        import logging
+        from logging.handlers import RotatingFileHandler
+        logger = logging.getLogger("qhar.timing")
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        handler = RotatingFileHandler(filename, maxBytes=max_bytes, backupCount=backup_count)
+        handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+        logger.addHandler(handler)
+        self.add_sink(logger.info)
+
+    def trace_to_file(self, filename):
+        """Collect the timed calls as Chrome trace events (chrome://tracing),
+        they are written by flush()"""
+        self.trace = []
+        self.trace_file = filename
+
+    def configure(self, environ=os.environ):
+        """Configure from the environment: QHAR_TIMING=1 (or memory) enables
+        timing, QHAR_TIMING_LOG and QHAR_TIMING_TRACE name the log and the
+        trace file (and enable timing too). Return True if timing was
+        enabled."""
+        timing = environ.get("QHAR_TIMING", "0")
+        if environ.get("QHAR_TIMING_LOG"):
+            self.log_to_file(environ["QHAR_TIMING_LOG"])
+        if environ.get("QHAR_TIMING_TRACE"):
+            self.trace_to_file(environ["QHAR_TIMING_TRACE"])
+        if timing in ("", "0") and len(self.sinks) == 0 and self.trace is None:
+            return False
+        self.enable(memory=timing == "memory")
+        return True
+
+    def wrap(self, owner, name, rows, aggregate):
+        key = (owner, name)
+        if key in self.originals:
+            return
+        original = owner.__dict__[name]
+        self.originals[key] = original
+        label = "{0}.{1}".format(owner.__name__, name)
+        if aggregate:
+            wrapper = self.aggregate_wrapper(original, label)
+        elif inspect.isgeneratorfunction(original):
+            wrapper = self.generator_wrapper(original, label, rows)
+        else:
+            wrapper = self.function_wrapper(original, label, rows)
+        setattr(owner, name, functools.wraps(original)(wrapper))
+
+    def function_wrapper(self, original, label, rows):
+        def wrapper(instance, *args, **kwargs):
+            span = self.begin(label)
+            try:
+                return original(instance, *args, **kwargs)
+            finally:
+                self.end(span, rows(instance) if rows is not None else None)
+        return wrapper
+
+    def generator_wrapper(self, original, label, rows):
+        def wrapper(instance, *args, **kwargs):
+            span = self.begin(label)
+            yielded = 0
+            try:
+                for item in original(instance, *args, **kwargs):
+                    yielded += 1
+                    yield item
+            finally:
+                self.end(span, rows(instance) if rows is not None else yielded)
+        return wrapper
+
+    def aggregate_wrapper(self, original, label):
+        totals = self.totals.setdefault(label, [0, 0.0])
+
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                totals[0] += 1
+                totals[1] += time.perf_counter() - start
+        return wrapper
+
+    def begin(self, label):
+        depth = getattr(self.depth, "value", 0)
+        self.depth.value = depth + 1
+        if self.memory and depth == 0:
+            import tracemalloc
+            tracemalloc.reset_peak()
+        return Span(label)
+
+    def end(self, span, rows):
+        span.seconds = time.perf_counter() - span.start
+        span.rows = rows
+        self.depth.value -= 1
+        if self.memory and self.depth.value == 0:
+            import tracemalloc
+            span.peak = tracemalloc.get_traced_memory()[1]
+        self.emit(span.summary())
+        if self.trace is not None:
+            args = {"rows": span.rows}
+            if span.peak is not None:
+                args["peak_bytes"] = span.peak
+            self.trace.append({"name": span.name, "ph": "X", "pid": os.getpid(),
+                               "tid": threading.get_ident(), "ts": 1e6 * (span.start - self.origin),
+                               "dur": 1e6 * span.seconds, "args": args})
+        if self.depth.value == 0:
+            self.report_totals()
+
+    def report_totals(self):
+        """Report the calls of aggregated methods since the last report"""
+        for label, totals in self.totals.items():
+            if totals[0] > 0:
+                self.emit("{0}: {1} calls, {2:.1f} ms".format(label, totals[0], 1000 * totals[1]))
+                if self.trace is not None:
+                    self.trace.append({"name": label, "ph": "C", "pid": os.getpid(),
+                                       "ts": 1e6 * (time.perf_counter() - self.origin),
+                                       "args": {"calls": totals[0], "ms": 1000 * totals[1]}})
+                totals[0], totals[1] = 0, 0.0
+
+    def emit(self, line):
+        for sink in self.sinks:
+            try:
+                sink(line)
+            except Exception:
+                pass
+
+    def flush(self):
+        """Write the Chrome trace file"""
+        if self.trace is not None and self.trace_file is not None:
+            try:
+                with open(self.trace_file, "w") as trace_file:
+                    json.dump({"traceEvents": self.trace, "displayTimeUnit": "ms"}, trace_file)
+            except OSError:
+                pass
+
+
+# the instrumentation shared by the whole program
+instruments = Instrumentation()
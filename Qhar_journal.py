@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+# This file is part of Qhar.
+# Qhar is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# Qhar is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with Qhar.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import os
+import time
+from Qhar_schema import Schema
+
+
+class ChangeJournal(Schema):
+    """This object appends the changes of the recipes of a database to a
+    journal file next to it, one JSON line per change holding the sql_action
+    and the sql_params of the recipe. Appending only writes to a buffer: it
+    is synced to the disk at most every sync_interval seconds and by sync(),
+    so a change costs microseconds. The journal is cleared once the changes
+    are saved into the database; if the program ends before that, the next
+    session replays it."""
+    def __init__(self, database, sync_interval=0.5):
+        super(ChangeJournal, self).__init__()
+        self.database = database
+        self.filename = database + ".journal"
+        self.sync_interval = sync_interval
+        self.file = None
+        # size of the journal when it was opened
+        self.start = 0
+        self.pending = 0
+        self.synced = time.monotonic()
+
+    def open(self):
+        """Open the journal for appending. Return False if it can't be
+        written, changes aren't journaled then."""
+        try:
+            self.file = open(self.filename, "a", encoding="utf-8")
+            self.start = self.file.tell()
+            return True
+        except OSError:
+            self.file = None
+            return False
+
+    def append(self, action, params):
+        if self.file is None:
+            return
+        try:
+            self.file.write(json.dumps([action] + list(params), ensure_ascii=False, separators=(",", ":")) + "\n")
+            self.pending += 1
+            if time.monotonic() - self.synced >= self.sync_interval:
+                self.sync()
+        except (OSError, TypeError, ValueError):
+            self.close()
+
+    def sync(self):
+        """Write the appended changes to the disk"""
+        if self.file is None or self.pending == 0:
+            return
+        try:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.pending = 0
+            self.synced = time.monotonic()
+        except OSError:
+            self.close()
+
+    def records(self):
+        """Read the journal and return a dict of hash: (sql_action, values),
+        only the last change of every recipe is kept. A line cut short by a
+        crash ends the journal."""
+        records = dict()
+        try:
+            with open(self.filename, encoding="utf-8") as journal:
+                for line in journal:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break
+                    if record[0] == "DELETE":
+                        records[record[1]] = ("DELETE", None)
+                    else:
+                        records[record[-1]] = (record[0], dict(zip(self.db_types, record[1:-1])))
+        except (OSError, IndexError, TypeError):
+            pass
+        return records
+
+    def clear(self):
+        """Empty the journal after its changes were saved"""
+        if self.file is None:
+            return
+        try:
+            self.file.flush()
+            self.file.truncate(0)
+            os.fsync(self.file.fileno())
+            self.pending = 0
+        except OSError:
+            self.close()
+
+    def rollback(self):
+        """Close the journal and drop the changes appended since it was
+        opened, the changes of earlier sessions are kept"""
+        if self.file is None:
+            return
+        try:
+            self.file.flush()
+            self.file.truncate(self.start)
+            os.fsync(self.file.fileno())
+        except OSError:
+            pass
+        self.close()
+
+    def close(self):
+        if self.file is not None:
+            try:
+                self.file.close()
+            except OSError:
+                pass
+            self.file = None
+
+    def discard(self):
+        """Close and remove the journal, its changes are given up"""
+        self.close()
+        try:
+            os.remove(self.filename)
+        except OSError:
+            pass
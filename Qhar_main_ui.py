@@ -61,23 +61,21 @@ class Ui_MainWindow(object):
         self.horizontalLayout_3.setObjectName(_fromUtf8("horizontalLayout_3"))
         self.gridLayout_3 = QtGui.QGridLayout()
         self.gridLayout_3.setObjectName(_fromUtf8("gridLayout_3"))
-        self.tableWidget_view = QtGui.QTableWidget(self.page_view)
-        self.tableWidget_view.setVerticalScrollBarPolicy(QtCore.Qt.ScrollBarAsNeeded)
-        self.tableWidget_view.setHorizontalScrollBarPolicy(QtCore.Qt.ScrollBarAsNeeded)
-        self.tableWidget_view.setAutoScroll(False)
-        self.tableWidget_view.setEditTriggers(QtGui.QAbstractItemView.NoEditTriggers)
-        self.tableWidget_view.setDragDropOverwriteMode(False)
-        self.tableWidget_view.setAlternatingRowColors(True)
-        self.tableWidget_view.setSelectionMode(QtGui.QAbstractItemView.SingleSelection)
-        self.tableWidget_view.setSelectionBehavior(QtGui.QAbstractItemView.SelectRows)
-        self.tableWidget_view.setCornerButtonEnabled(False)
-        self.tableWidget_view.setRowCount(0)
-        self.tableWidget_view.setColumnCount(8)
-        self.tableWidget_view.setObjectName(_fromUtf8("tableWidget_view"))
-        self.tableWidget_view.horizontalHeader().setCascadingSectionResizes(True)
-        self.tableWidget_view.horizontalHeader().setStretchLastSection(False)
-        self.tableWidget_view.verticalHeader().setStretchLastSection(False)
-        self.gridLayout_3.addWidget(self.tableWidget_view, 0, 0, 1, 1)
+        self.tableView_view = QtGui.QTableView(self.page_view)
+        self.tableView_view.setVerticalScrollBarPolicy(QtCore.Qt.ScrollBarAsNeeded)
+        self.tableView_view.setHorizontalScrollBarPolicy(QtCore.Qt.ScrollBarAsNeeded)
+        self.tableView_view.setAutoScroll(False)
+        self.tableView_view.setEditTriggers(QtGui.QAbstractItemView.NoEditTriggers)
+        self.tableView_view.setDragDropOverwriteMode(False)
+        self.tableView_view.setAlternatingRowColors(True)
+        self.tableView_view.setSelectionMode(QtGui.QAbstractItemView.SingleSelection)
+        self.tableView_view.setSelectionBehavior(QtGui.QAbstractItemView.SelectRows)
+        self.tableView_view.setCornerButtonEnabled(False)
+        self.tableView_view.setObjectName(_fromUtf8("tableView_view"))
+        self.tableView_view.horizontalHeader().setCascadingSectionResizes(True)
+        self.tableView_view.horizontalHeader().setStretchLastSection(False)
+        self.tableView_view.verticalHeader().setStretchLastSection(False)
+        self.gridLayout_3.addWidget(self.tableView_view, 0, 0, 1, 1)
         self.horizontalLayout_2 = QtGui.QHBoxLayout()
         self.horizontalLayout_2.setObjectName(_fromUtf8("horizontalLayout_2"))
         self.label_filter = QtGui.QLabel(self.page_view)
@@ -246,7 +244,7 @@ class Ui_MainWindow(object):
 
     def retranslateUi(self, MainWindow):
         MainWindow.setWindowTitle(_translate("MainWindow", "MainWindow", None))
-        self.tableWidget_view.setSortingEnabled(True)
+        self.tableView_view.setSortingEnabled(True)
         self.label_filter.setText(_translate("MainWindow", "TextLabel", None))
         self.pushButton_select.setText(_translate("MainWindow", "PushButton", None))
         self.menu_File.setTitle(_translate("MainWindow", "&File", None))
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+# This file is part of Qhar.
+# Qhar is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# Qhar is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with Qhar.  If not, see <http://www.gnu.org/licenses/>.
+
+from PyQt4.QtCore import *
+from PyQt4.QtGui import *
+
+
+class RecipeTableModel(QAbstractTableModel):
+    """Table model which reads the recipes matching the filter directly from
+    the RecipeContainer. Rows are fetched a page at a time, only when the
+    view asks for them; the container caches the pages."""
+    def __init__(self, container, parent=None):
+        super(RecipeTableModel, self).__init__(parent)
+        self.container = container
+        self.columns = [None, None, "name", "book", "page", "time_to_cook", "side_dish_id", None]
+        self.headers = [" ", "Main Dish ID", container.arguments["name"],
+                        container.arguments["book"], container.arguments["page"],
+                        container.arguments["time_to_cook"], container.arguments["side_dish_id"],
+                        container.arguments["side_dish_id"].replace("ID", "")]
+        self.__count = 0
+        self.__order = (None, False)
+
+    def reset_recipes(self):
+        """Reload the model after the filter, the sort order or the recipes
+        have changed"""
+        self.beginResetModel()
+        self.container.reset_view(*self.__order)
+        self.__count = self.container.recipe_count()
+        self.endResetModel()
+
+    def recipes_added(self, recipe_ids):
+        """Append recipes added while a database is being loaded, the rows
+        already shown stay as they are. A sorted or searched view is reset."""
+        num = self.container.extend_view(recipe_ids)
+        if num is None:
+            self.reset_recipes()
+        elif num > 0:
+            self.beginInsertRows(QModelIndex(), self.__count, self.__count + num - 1)
+            self.__count += num
+            self.endInsertRows()
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return self.__count
+
+    def columnCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.columns)
+
+    def recipe(self, row):
+        """Return (recipe_id, recipe_item, side_dish_item) for row"""
+        page_size = self.container.page_size
+        page, position = divmod(row, page_size)
+        rows, side_dishes = self.container.recipe_page(page * page_size, page_size)
+        if position >= len(rows):
+            return None
+        recipe_id, recipe_item = rows[position]
+        return recipe_id, recipe_item, side_dishes.get(recipe_item["side_dish_id"])
+
+    def recipe_id(self, row):
+        """Return the hash of the recipe in row"""
+        entry = self.recipe(row)
+        if entry is None:
+            return None
+        return entry[0]
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        entry = self.recipe(index.row())
+        if entry is None:
+            return None
+        recipe_id, recipe_item, side_dish_item = entry
+        column = index.column()
+        is_side_dish = recipe_item["recipe_type"] == self.container.recipe_types["side_dish"]
+        if role == Qt.DisplayRole:
+            if column == 1:
+                return recipe_id
+            elif column == 5:
+                return " {}".format(recipe_item["time_to_cook"])
+            elif column == 6:
+                if side_dish_item is not None:
+                    return recipe_item["side_dish_id"]
+            elif column == 7:
+                if is_side_dish:
+                    return None
+                elif side_dish_item is not None:
+                    return side_dish_item["name"]
+                else:
+                    return "Select side dish"
+            elif self.columns[column] is not None:
+                return "{}".format(recipe_item[self.columns[column]])
+        elif role == Qt.ToolTipRole:
+            if column == 7 and not is_side_dish and side_dish_item is None:
+                return "Doubleclick to select side dish"
+        elif role == Qt.UserRole:
+            if column == 0:
+                return recipe_item.sql_action
+            elif column == 5:
+                return bool(recipe_item["exact_time_to_cook"])
+        return None
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole:
+            return None
+        if orientation == Qt.Horizontal:
+            return self.headers[section]
+        return "{}".format(section + 1)
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        """Sort by the column clicked. Sorting is done by the container (in
+        SQL when the database is opened in windowed mode)."""
+        if column in (2, 3, 4, 5):
+            self.__order = (self.columns[column], order == Qt.DescendingOrder)
+        else:
+            self.__order = (None, False)
+        self.reset_recipes()
+
+
+class StatusDelegate(QStyledItemDelegate):
+    """Paint the status of the recipe (its sql_action) as a coloured cell"""
+    colors = {"TODAY": "yellow",
+              "INSERT": "blue",
+              "UPDATE": "green",
+              "DELETE": "red"}
+
+    def __init__(self, parent=None):
+        super(StatusDelegate, self).__init__(parent)
+        self.brushes = {status: QBrush(QColor(color)) for status, color in self.colors.items()}
+        self.default_brush = QBrush(QColor("gray"))
+
+    def paint(self, painter, option, index):
+        painter.fillRect(option.rect, self.brushes.get(index.data(Qt.UserRole), self.default_brush))
+
+
+class TimeToCookDelegate(QStyledItemDelegate):
+    """Paint time to cook as a read only checkbox which is checked if the
+    time to cook is exact"""
+    def paint(self, painter, option, index):
+        if option.state & QStyle.State_Selected:
+            painter.fillRect(option.rect, option.palette.highlight())
+        button = QStyleOptionButton()
+        button.rect = option.rect
+        button.palette = option.palette
+        button.text = index.data(Qt.DisplayRole)
+        if index.data(Qt.UserRole):
+            button.state = QStyle.State_On
+        else:
+            button.state = QStyle.State_Off
+        QApplication.style().drawControl(QStyle.CE_CheckBox, button, painter)
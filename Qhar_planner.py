@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+# This file is part of Qhar.
+# Qhar is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# Qhar is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with Qhar.  If not, see <http://www.gnu.org/licenses/>.
+
+import random
+
+
+def assign_times(available_times, bucket_sizes, tolerance=30, rnd=random):
+    """Assign a time to cook to every day, using at most bucket_sizes[time]
+    recipes of every time. The most days possible get a recipe, among those
+    assignments the one with the smallest total difference between the
+    available time and the time to cook is chosen. Ties are broken randomly.
+    Return a list with a time to cook (or None) for every day."""
+    if len(available_times) == 0:
+        return []
+    days = dict()
+    for num, available_time in enumerate(available_times):
+        days.setdefault(available_time, []).append(num)
+    if all(bucket_sizes.get(available_time, 0) >= len(nums) for available_time, nums in days.items()):
+        # every day can get a recipe which takes exactly the available time
+        return list(available_times)
+    # days with the same available time and recipes with the same time to
+    # cook are interchangeable, so only the groups are matched
+    flows = group_flows({available_time: len(nums) for available_time, nums in days.items()},
+                        bucket_sizes, tolerance, rnd)
+    times = [None] * len(available_times)
+    for available_time, nums in days.items():
+        nums = list(nums)
+        rnd.shuffle(nums)
+        assigned = [time_to_cook for time_to_cook, flow in sorted(flows.get(available_time, {}).items())
+                    for num in range(flow)]
+        for num, time_to_cook in zip(nums, assigned):
+            times[num] = time_to_cook
+    return times
+
+
+def group_flows(demand, bucket_sizes, tolerance, rnd):
+    """Solve the transportation problem between the available times (with
+    demand[time] days each) and the buckets of recipes as a min cost max
+    flow. Return a dict of available time: {time to cook: number of days}.
+    The random noise added to the costs sums to less than one minute, so it
+    only breaks ties."""
+    noise = 1.0 / (sum(demand.values()) + 1)
+    graph = FlowGraph()
+    source, sink = graph.node(), graph.node()
+    groups = dict()
+    buckets = dict()
+    for available_time, num in demand.items():
+        groups[available_time] = graph.node()
+        graph.edge(source, groups[available_time], num, 0.0)
+    edges = dict()
+    for time_to_cook, size in bucket_sizes.items():
+        if size <= 0:
+            continue
+        for available_time in demand:
+            distance = abs(time_to_cook - available_time)
+            if distance <= tolerance:
+                if time_to_cook not in buckets:
+                    buckets[time_to_cook] = graph.node()
+                    graph.edge(buckets[time_to_cook], sink, size, 0.0)
+                edges[(available_time, time_to_cook)] = graph.edge(
+                    groups[available_time], buckets[time_to_cook], demand[available_time],
+                    distance + noise * rnd.random())
+    graph.min_cost_flow(source, sink)
+    flows = dict()
+    for (available_time, time_to_cook), edge in edges.items():
+        flow = graph.flow(edge)
+        if flow > 0:
+            flows.setdefault(available_time, dict())[time_to_cook] = flow
+    return flows
+
+
+class FlowGraph(object):
+    """Residual graph for the min cost flow of group_flows(). It has a node
+    per group of days and per bucket, so it stays small for any number of
+    days and recipes."""
+    def __init__(self):
+        self.adjacent = []
+        # edges as [to, capacity, cost], an edge and its reverse are at
+        # positions 2n and 2n+1
+        self.edges = []
+
+    def node(self):
+        self.adjacent.append([])
+        return len(self.adjacent) - 1
+
+    def edge(self, start, end, capacity, cost):
+        """Add an edge and return its number"""
+        self.adjacent[start].append(len(self.edges))
+        self.edges.append([end, capacity, cost])
+        self.adjacent[end].append(len(self.edges))
+        self.edges.append([start, 0, -cost])
+        return len(self.edges) - 2
+
+    def flow(self, edge):
+        return self.edges[edge ^ 1][1]
+
+    def min_cost_flow(self, source, sink):
+        """Send the most flow possible from source to sink along the
+        cheapest paths (successive shortest paths, Bellman-Ford)"""
+        nodes = len(self.adjacent)
+        while True:
+            distance = [float("inf")] * nodes
+            through = [None] * nodes
+            distance[source] = 0.0
+            queue = [source]
+            queued = [False] * nodes
+            queued[source] = True
+            while len(queue) > 0:
+                start = queue.pop()
+                queued[start] = False
+                for edge in self.adjacent[start]:
+                    end, capacity, cost = self.edges[edge]
+                    if capacity > 0 and distance[start] + cost < distance[end] - 1e-12:
+                        distance[end] = distance[start] + cost
+                        through[end] = edge
+                        if not queued[end]:
+                            queued[end] = True
+                            queue.append(end)
+            if through[sink] is None:
+                return
+            path = []
+            node = sink
+            while node != source:
+                path.append(through[node])
+                node = self.edges[through[node] ^ 1][0]
+            amount = min(self.edges[edge][1] for edge in path)
+            for edge in path:
+                self.edges[edge][1] -= amount
+                self.edges[edge ^ 1][1] += amount
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+# This file is part of Qhar.
+# Qhar is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# Qhar is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with Qhar.  If not, see <http://www.gnu.org/licenses/>.
+
+from types import MappingProxyType
+
+
+class Schema(object):
+    """This object holds information about the arguments, types and lenghts of
+    data used in this program. The values are shared by the whole program
+    and can't be changed."""
+    __slots__ = ()
+    table_name = "recipes"
+    # PRAGMA user_version of databases written by this version
+    schema_version = 4
+    # full text index of the names and books
+    search_table = "recipes_search"
+    arguments = MappingProxyType({"name": "Name",
+                                  "book": "Book",
+                                  "page": "Page",
+                                  "time_to_cook": "Time to cook",
+                                  "exact_time_to_cook": "Exact time to cook",
+                                  "recipe_type": "Recipe type",
+                                  "last_cooked": "Last cooked",
+                                  "side_dish_id": "Side dish ID"})
+    db_types = MappingProxyType({"name": "VARCHAR",
+                                 "book": "VARCHAR",
+                                 "page": "INT",
+                                 "time_to_cook": "INT",
+                                 "exact_time_to_cook": "BOOLEAN",
+                                 "recipe_type": "VARCHAR",
+                                 "last_cooked": "DATE",
+                                 "side_dish_id": "VARCHAR"})
+    arguments_required = MappingProxyType({"name": True,
+                                           "book": True,
+                                           "page": True,
+                                           "time_to_cook": False,
+                                           "exact_time_to_cook": False,
+                                           "recipe_type": False,
+                                           "last_cooked": False,
+                                           "side_dish_id": False})
+    required = ("name", "book", "page")
+    # dates are day ordinals (date.toordinal) in the program, ISO 8601 in
+    # the database and formatted like this for the user
+    date_string = "dd.MM.yyyy"
+    # date_string for datetime.strptime/strftime
+    date_format = "%d.%m.%Y"
+    recipe_types = MappingProxyType({"one_course_meal": "Samostojna jed",
+                                     "side_dish": "Priloga",
+                                     "main_course_with_meat": "Mesna jed",
+                                     "main_course_with_vegetables": "Zelenjavna jed",
+                                     "soup": "Juha"})
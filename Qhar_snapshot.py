@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+# This file is part of Qhar.
+# Qhar is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# Qhar is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with Qhar.  If not, see <http://www.gnu.org/licenses/>.
+
+import binascii
+import mmap
+import os
+import struct
+import sys
+from array import array
+from Qhar_schema import Schema
+
+
+class SnapshotCache(Schema):
+    """This object stores the validated recipes of a database in a binary
+    file next to it (filename.snapshot). Every column is stored as an array,
+    strings are stored once in a string table and referenced by index. The
+    snapshot is only used while the database file is unchanged.
+
+    Layout: header, hashes (20 bytes per row), one array per column in the
+    order of db_types, the string table (strings separated by NUL). Sections
+    are padded to 8 bytes."""
+    magic = b"QHSN"
+    format_version = 2
+    # magic, format, schema version, byte order, db mtime (ns), db size,
+    # expiry (day ordinal), rows, strings, string table size
+    header = struct.Struct("<4sHHBxxxqqqqqq")
+    # array typecodes of the column types, None is stored as the sentinel
+    typecodes = {"VARCHAR": "i", "INT": "q", "BOOLEAN": "b", "DATE": "i"}
+    none_values = {"VARCHAR": -1, "INT": -2**63, "BOOLEAN": -1, "DATE": 0}
+
+    def __init__(self, database):
+        super(SnapshotCache, self).__init__()
+        self.database = database
+        self.filename = database + ".snapshot"
+
+    def signature(self):
+        """Return (mtime, size) of the database or None if it can't be used.
+        Changes which are still in the write-ahead log don't show in the
+        mtime, so the log has to be empty."""
+        try:
+            stat = os.stat(self.database)
+            if os.path.exists(self.database + "-wal") and os.path.getsize(self.database + "-wal") > 0:
+                return None
+            return stat.st_mtime_ns, stat.st_size
+        except OSError:
+            return None
+
+    def remove(self):
+        """Remove a snapshot which doesn't match the database anymore"""
+        try:
+            os.remove(self.filename)
+        except OSError:
+            pass
+
+    def padding(self, size):
+        return b"\0" * (-size % 8)
+
+    def save(self, recipes, expiry):
+        """Write the recipes (a dict of hash: values) validated for the
+        planning window starting at expiry. Return True on success."""
+        signature = self.signature()
+        if signature is None:
+            self.remove()
+            return False
+        strings = dict()
+        columns = {key: array(self.typecodes[db_type]) for key, db_type in self.db_types.items()}
+        hashes = bytearray()
+        try:
+            for recipe_hash, values in recipes.items():
+                hashes += binascii.unhexlify(recipe_hash)
+                for key, db_type in self.db_types.items():
+                    value = values[key]
+                    if value is None:
+                        value = self.none_values[db_type]
+                    elif db_type == "VARCHAR":
+                        value = strings.setdefault(value, len(strings))
+                    columns[key].append(value)
+            table = "\0".join(strings).encode("utf-8")
+            if len(strings) > 0 and table.count(b"\0") != len(strings) - 1:
+                # a string contains the separator
+                self.remove()
+                return False
+            temporary = self.filename + ".tmp"
+            with open(temporary, "wb") as snapshot:
+                snapshot.write(self.header.pack(self.magic, self.format_version, self.schema_version,
+                                                sys.byteorder == "little", signature[0], signature[1],
+                                                expiry, len(recipes), len(strings), len(table)))
+                snapshot.write(hashes + self.padding(len(hashes)))
+                for column in columns.values():
+                    data = column.tobytes()
+                    snapshot.write(data + self.padding(len(data)))
+                snapshot.write(table)
+            os.replace(temporary, self.filename)
+            return True
+        except (OSError, ValueError, KeyError, struct.error, OverflowError):
+            self.remove()
+            return False
+
+    def load(self, expiry):
+        """Return a list of (hash, values) if the snapshot matches the
+        database, else None. Dates before expiry are dropped like they are
+        when recipes are validated."""
+        signature = self.signature()
+        if signature is None or not os.path.exists(self.filename):
+            return None
+        try:
+            with open(self.filename, "rb") as snapshot:
+                with mmap.mmap(snapshot.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    return self.read(data, signature, expiry)
+        except (OSError, ValueError, TypeError, IndexError, BufferError, struct.error):
+            return None
+
+    def read(self, data, signature, expiry):
+        """Read the columns out of the mapped snapshot"""
+        if len(data) < self.header.size:
+            return None
+        (magic, format_version, schema_version, little_endian, mtime, size,
+         saved_expiry, rows, num_strings, table_size) = self.header.unpack_from(data)
+        if (magic != self.magic or format_version != self.format_version or
+                schema_version != self.schema_version or bool(little_endian) != (sys.byteorder == "little") or
+                (mtime, size) != signature or expiry < saved_expiry):
+            # expired dates can't be restored if the clock went back
+            return None
+        view = memoryview(data)
+        try:
+            offset = self.header.size
+            hashes = binascii.hexlify(view[offset:offset+20*rows]).decode("ascii")
+            offset += 20 * rows + (-20 * rows % 8)
+            columns = dict()
+            for key, db_type in self.db_types.items():
+                itemsize = array(self.typecodes[db_type]).itemsize
+                column = view[offset:offset+itemsize*rows].cast(self.typecodes[db_type])
+                columns[key] = column.tolist()
+                column.release()
+                offset += itemsize * rows + (-itemsize * rows % 8)
+            if offset + table_size != len(data):
+                return None
+            strings = str(view[offset:offset+table_size], "utf-8").split("\0") if num_strings > 0 else []
+        finally:
+            view.release()
+
+        for key, db_type in self.db_types.items():
+            none_value = self.none_values[db_type]
+            if db_type == "VARCHAR":
+                columns[key] = [strings[value] if value != none_value else None for value in columns[key]]
+            elif db_type == "BOOLEAN":
+                columns[key] = [bool(value) if value != none_value else None for value in columns[key]]
+            elif db_type == "DATE":
+                columns[key] = [value if value >= expiry else None for value in columns[key]]
+            else:
+                columns[key] = [value if value != none_value else None for value in columns[key]]
+        keys = list(columns)
+        return [(hashes[40*num:40*num+40], dict(zip(keys, values)))
+                for num, values in enumerate(zip(*columns.values()))]
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+# This file is part of Qhar.
+# Qhar is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# Qhar is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with Qhar.  If not, see <http://www.gnu.org/licenses/>.
+
+# This module must not import Qt: its functions run in worker processes.
+
+import hashlib
+from collections import deque
+from datetime import date, datetime
+from Qhar_schema import Schema
+
+TRUE_VALUES = frozenset([True, 1, "1", "true", "True", "yes"])
+
+
+def recipe_hash(*required):
+    """Return the hash identifying a recipe by its required values. It is
+    used as the key of the recipe list and registered as an SQL function."""
+    string = "|".join(sorted(str(item) for item in required))
+    return hashlib.sha1(string.encode('utf-8')).hexdigest()
+
+
+def convert_value(key, value):
+    """Convert value to datatype given in db_types. Return None if the value
+    can't be converted."""
+    if value is None:
+        return None
+    try:
+        if Schema.db_types[key] == "BOOLEAN":
+            return value in TRUE_VALUES
+        elif Schema.db_types[key] == "INT":
+            return int(value)
+        elif Schema.db_types[key] == "DATE":
+            return date_ordinal(value)
+        else:
+            if len(str(value)) > 0:
+                return str(value)
+            return None
+    except Exception:
+        return None
+
+
+def date_ordinal(value):
+    """Return the day ordinal of a date given as ordinal, ISO 8601 string (as
+    stored in the database) or in date_format (as typed by users)"""
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    value = str(value)
+    if "-" in value:
+        return date.fromisoformat(value).toordinal()
+    return datetime.strptime(value, Schema.date_format).toordinal()
+
+
+def sql_value(key, value):
+    """Convert value to the type stored in the database"""
+    if value is not None and Schema.db_types[key] == "DATE":
+        return date.fromordinal(value).isoformat()
+    return value
+
+
+def csv_value(key, value):
+    """Convert value to the text written to CSV files, dates in date_format"""
+    if value is None:
+        return ""
+    if Schema.db_types[key] == "DATE":
+        return date.fromordinal(value).strftime(Schema.date_format)
+    if Schema.db_types[key] == "BOOLEAN":
+        return int(value)
+    return value
+
+
+def validate_row(values, expiry):
+    """Validate and convert one row (a dict of argument: value). Dates of last
+    cooked before expiry (a day ordinal) are dropped. Return (values, None)
+    for valid rows and (None, reason) for rejected ones."""
+    if values is None:
+        return None, "empty row"
+    output = dict()
+    for key, required in Schema.arguments_required.items():
+        if key in values:
+            output[key] = convert_value(key, values[key])
+        elif required:
+            return None, "missing {0}".format(Schema.arguments[key])
+        else:
+            output[key] = None
+
+    # errors in required arguments are fatal
+    if output["name"] is None:
+        return None, "invalid {0}".format(Schema.arguments["name"])
+    if output["book"] is None:
+        return None, "invalid {0}".format(Schema.arguments["book"])
+    if output["page"] is None or output["page"] < 0:
+        return None, "invalid {0}".format(Schema.arguments["page"])
+
+    # validation of optional arguments
+    if output["recipe_type"] not in Schema.recipe_types.values():
+        output["recipe_type"] = Schema.recipe_types["one_course_meal"]
+    if output["time_to_cook"] is None:
+        output["time_to_cook"] = 60
+    if output["last_cooked"] is not None and output["last_cooked"] < expiry:
+        # recipe has expired
+        output["last_cooked"] = None
+    return output, None
+
+
+def validate_batch(rows, start, expiry):
+    """Validate and hash a batch of rows. Return a list of (row_number, values,
+    recipe_hash) for valid rows and (row_number, None, reason) for rejected
+    ones, row_number counting from start."""
+    results = []
+    for num, row in enumerate(rows, start):
+        values, reason = validate_row(row, expiry)
+        if values is None:
+            results.append((num, None, reason))
+        else:
+            results.append((num, values, recipe_hash(*[values[key] for key in Schema.required])))
+    return results
+
+
+class BulkValidator(object):
+    """This object validates and hashes large amounts of rows. Rows are split
+    into batches which are validated by a pool of worker processes. Results
+    are returned in the order of the rows; rejected rows are collected in
+    self.rejected as (row_number, reason)."""
+    def __init__(self, expiry, batch_size=10000, processes=None):
+        self.expiry = expiry
+        self.batch_size = batch_size
+        self.processes = processes
+        self.rejected = []
+
+    def batches(self, rows):
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == self.batch_size:
+                yield batch
+                batch = []
+        if len(batch) > 0:
+            yield batch
+
+    def collect(self, results):
+        """Yield valid results and remember the rejected ones"""
+        for num, values, extra in results:
+            if values is None:
+                self.rejected.append((num, extra))
+            else:
+                yield num, values, extra
+
+    def validate(self, rows, start=1):
+        """Yield (row_number, values, recipe_hash) for every valid row. With
+        processes=1 the rows are validated in this process."""
+        if self.processes == 1:
+            for batch in self.batches(rows):
+                for result in self.collect(validate_batch(batch, start, self.expiry)):
+                    yield result
+                start += len(batch)
+            return
+        # imported here, they are slow to import and only needed for big files
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        # spawn, because forking a process with running (Qt) threads isn't safe
+        pool = ProcessPoolExecutor(self.processes, multiprocessing.get_context("spawn"))
+        try:
+            # keep only a few batches in flight so memory stays bounded
+            pending = deque()
+            max_pending = 2 * (self.processes or multiprocessing.cpu_count())
+            for batch in self.batches(rows):
+                pending.append(pool.submit(validate_batch, batch, start, self.expiry))
+                start += len(batch)
+                if len(pending) >= max_pending:
+                    for result in self.collect(pending.popleft().result()):
+                        yield result
+            while len(pending) > 0:
+                for result in self.collect(pending.popleft().result()):
+                    yield result
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    def report(self, limit=None):
+        """Return lines describing why rows were rejected"""
+        lines = ["Row {0}: {1}".format(num, reason) for num, reason in self.rejected[:limit]]
+        if limit is not None and len(self.rejected) > limit:
+            lines.append("... and {0} more rejected rows".format(len(self.rejected) - limit))
+        return lines
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+# This file is part of Qhar.
+# Qhar is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# Qhar is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with Qhar.  If not, see <http://www.gnu.org/licenses/>.
+
+import random
+from PyQt4.QtCore import *
+from Qhar_data import *
+from Qhar_files import *
+from Qhar_snapshot import SnapshotCache
+from Qhar_validation import BulkValidator
+
+
+class RecipeWorker(QObject):
+    """Base of the objects which read recipes on a worker thread. Recipes are
+    handed to the GUI thread in chunks, at most max_pending chunks wait to
+    be merged at any time."""
+    chunk_ready = pyqtSignal(list, int)
+    progress = pyqtSignal(int)
+    done = pyqtSignal(tuple)
+
+    def __init__(self, filename, chunk_size=5000, max_pending=2):
+        super(RecipeWorker, self).__init__()
+        self.filename = filename
+        self.chunk_size = chunk_size
+        self.cancelled = False
+        self.__pending = QSemaphore(max_pending)
+
+    def cancel(self):
+        self.cancelled = True
+
+    def chunk_merged(self):
+        """Called by the GUI thread after a chunk was merged"""
+        self.__pending.release()
+
+    def send_chunk(self, chunk, rows):
+        """Wait until the GUI thread has room for another chunk and send it.
+        Return False if the worker was cancelled while waiting."""
+        while not self.__pending.tryAcquire(1, 100):
+            if self.cancelled:
+                return False
+        self.chunk_ready.emit(chunk, rows)
+        return True
+
+
+class ImportWorker(RecipeWorker):
+    """This object reads and validates a CSV file on a worker thread and
+    hands the valid recipes to the GUI thread. If a database is given, the
+    recipes are inserted into it instead."""
+    def __init__(self, filename, database=None, chunk_size=5000, max_pending=2, parallel_size=5000000):
+        super(ImportWorker, self).__init__(filename, chunk_size, max_pending)
+        self.database = database
+        # files of at least parallel_size bytes are validated by a process pool
+        self.parallel_size = parallel_size
+        self.validator = None
+
+    def rows(self, handle):
+        """Yield the rows of the CSV file until it ends, fails or the import
+        is cancelled. A failure is remembered in self.error."""
+        for item in handle:
+            if self.cancelled:
+                return
+            if type(item) is not dict:
+                self.error = item
+                return
+            self.rows_read += 1
+            yield item
+
+    def run(self):
+        handle = ImportExportHandler(self.filename, None)
+        size = handle.size()
+        # starting worker processes only pays off for big files
+        if size >= self.parallel_size:
+            self.validator = BulkValidator(RecipeItem.expiry_day, self.chunk_size)
+        else:
+            self.validator = BulkValidator(RecipeItem.expiry_day, self.chunk_size, processes=1)
+        self.error = None
+        self.rows_read = 0
+        if self.database is not None:
+            self.import_into_database(handle, size)
+            return
+        chunk = []
+        rows = 0
+        try:
+            for rows, values, recipe_hash in self.validator.validate(self.rows(handle)):
+                chunk.append(RecipeItem.from_validated(values, recipe_hash, "INSERT"))
+                if len(chunk) == self.chunk_size:
+                    if not self.send_chunk(chunk, rows):
+                        break
+                    chunk = []
+                    if size > 0:
+                        self.progress.emit(min(100, 100 * handle.bytes_read // size))
+            if self.cancelled or (len(chunk) > 0 and not self.send_chunk(chunk, rows)):
+                self.done.emit((False, "Import cancelled after {0} rows".format(rows)))
+                return
+            if self.error is not None:
+                self.done.emit(self.error)
+                return
+            self.progress.emit(100)
+            self.done.emit((True, "Read {0} rows, rejected {1}".format(self.rows_read, len(self.validator.rejected))))
+        except Exception:
+            self.done.emit((False, "Failed to load CSV file"))
+
+    def import_into_database(self, handle, size):
+        """Insert the valid rows into the database. The connection is opened
+        here, sqlite connections can't be shared between threads."""
+        def progress(rows):
+            if size > 0:
+                self.progress.emit(min(100, 100 * handle.bytes_read // size))
+        connection = DatabaseConnection(self.database)
+        importer = DatabaseImporter(connection, self.chunk_size, expected=size // 50)
+        try:
+            for ret in importer.import_rows(self.validator.validate(self.rows(handle)), progress):
+                if self.cancelled:
+                    ret = (False, "Import cancelled after {0} rows, {1} new recipes were stored".format(
+                        self.rows_read, importer.inserted))
+                elif self.error is not None:
+                    ret = self.error
+                else:
+                    self.progress.emit(100)
+                self.done.emit(ret)
+        except Exception:
+            self.done.emit((False, "Failed to import CSV file"))
+        finally:
+            connection.close()
+
+
+class LoadWorker(RecipeWorker):
+    """This object loads a database on a worker thread. The recipes needed to
+    plan the planning window come first: the planned ones and a random
+    sample of the others. The rest follow in chunks. Databases with more
+    than window_threshold rows are left to windowed mode, self.windowed is
+    set for them."""
+    def __init__(self, filename, window_threshold, sample_size=1000, chunk_size=5000, max_pending=2):
+        super(LoadWorker, self).__init__(filename, chunk_size, max_pending)
+        self.window_threshold = window_threshold
+        self.sample_size = sample_size
+        self.windowed = False
+        self.from_snapshot = False
+        self.rows_sent = 0
+
+    def send_recipes(self, first, rest, total):
+        """Send the recipes of first as one chunk, followed by the recipes of
+        rest which weren't in first. Return False if cancelled."""
+        chunk = []
+        sent = set()
+        for recipe in first:
+            if recipe.is_valid and recipe.sha1_hex() not in sent:
+                sent.add(recipe.sha1_hex())
+                chunk.append(recipe)
+        # sent even if empty, the week is shown after the first chunk
+        if not self.send_chunk(chunk, len(chunk)):
+            return False
+        self.rows_sent = len(chunk)
+        chunk = []
+        for recipe in rest:
+            if self.cancelled:
+                return False
+            if recipe.is_valid and recipe.sha1_hex() not in sent:
+                chunk.append(recipe)
+                if len(chunk) == self.chunk_size:
+                    if not self.send_chunk(chunk, self.rows_sent + len(chunk)):
+                        return False
+                    self.rows_sent += len(chunk)
+                    chunk = []
+                    if total > 0:
+                        self.progress.emit(min(100, 100 * self.rows_sent // total))
+        if len(chunk) > 0:
+            if not self.send_chunk(chunk, self.rows_sent + len(chunk)):
+                return False
+            self.rows_sent += len(chunk)
+        return True
+
+    def run(self):
+        # sqlite connections can't be shared between threads
+        connection = DatabaseConnection(self.filename)
+        try:
+            snapshot = SnapshotCache(self.filename).load(RecipeItem.expiry_day) if connection.exists() else None
+            if snapshot is not None and len(snapshot) <= self.window_threshold:
+                self.from_snapshot = True
+                recipes = [RecipeItem.from_validated(values, recipe_hash) for recipe_hash, values in snapshot]
+                first = [recipe for recipe in recipes if recipe["last_cooked"] is not None]
+                unplanned = [recipe for recipe in recipes if recipe["last_cooked"] is None and
+                             recipe["recipe_type"] != RecipeItem.recipe_types["side_dish"]]
+                first += random.sample(unplanned, min(self.sample_size, len(unplanned)))
+                sent = self.send_recipes(first, recipes, len(recipes))
+            elif not connection.exists():
+                self.done.emit((False, "No such database, loading aborted."))
+                return
+            elif not connection.check_structure():
+                self.done.emit((False, "Database corrupt, loading aborted."))
+                return
+            else:
+                connection.expire(RecipeItem.expiry_day)
+                repository = RecipeRepository(connection)
+                total = repository.count()
+                if total > self.window_threshold:
+                    self.windowed = True
+                    self.done.emit((True, "Opening {0} recipes in windowed mode".format(total)))
+                    return
+                first = [RecipeItem(item, None) for item in repository.horizon(*RecipeItem.planning_window)]
+                first += [RecipeItem(item, None) for item in repository.sample(self.sample_size)]
+                sent = self.send_recipes(first, (RecipeItem(item, None) for item in repository.select()), total)
+            if not sent:
+                self.done.emit((False, "Loading cancelled after {0} recipes".format(self.rows_sent)))
+            elif self.rows_sent == 0:
+                self.done.emit((False, "No recipes were loaded"))
+            else:
+                self.progress.emit(100)
+                self.done.emit((True, "Loaded {0} recipes from {1}".format(
+                    self.rows_sent, "snapshot" if self.from_snapshot else "database")))
+        except Exception:
+            self.done.emit((False, "Something went wrong when loading the database."))
+        finally:
+            connection.close()
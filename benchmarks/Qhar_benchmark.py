@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+# This file is part of Qhar.
+# Qhar is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# Qhar is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with Qhar.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Benchmark the hot paths of Qhar on synthetic catalogs and write the
+results as JSON, e.g.
+
+    Qhar_benchmark.py --sizes 1000,100000 --output new.json
+    Qhar_benchmark.py --sizes 1000,100000 --compare new.json
+
+The Qt scenarios run without a display, with the GUI of the application
+disabled. They are skipped when PyQt4 isn't installed.
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Qhar_catalog import CatalogGenerator
+from Qhar_data import RecipeContainer, RecipeItem
+from Qhar_files import ImportExportHandler
+from Qhar_validation import BulkValidator
+
+
+class Skipped(Exception):
+    pass
+
+
+class Benchmark(object):
+    """This object runs the scenarios for one catalog size. Every scenario
+    prepares its input with setup_* methods (not timed) and returns a
+    function which does the timed work and returns (status, message)."""
+    scenarios = ("db_save", "db_load", "db_load_snapshot", "csv_import", "csv_import_database",
+                 "csv_validate_parallel", "csv_export", "planning", "view_population")
+
+    def __init__(self, size, seed, directory):
+        self.size = size
+        self.seed = seed
+        self.directory = directory
+        self.database = os.path.join(directory, "catalog-{0}.db".format(size))
+        self.csv = os.path.join(directory, "catalog-{0}.csv".format(size))
+
+    def rows(self):
+        return CatalogGenerator(self.seed).rows(self.size)
+
+    def container(self, recipes=True):
+        """Return a container holding the catalog as unsaved imports"""
+        container = RecipeContainer()
+        if recipes:
+            container.merge_recipes(RecipeItem(row, "INSERT") for row in self.rows())
+        return container
+
+    def setup_csv(self):
+        if not os.path.exists(self.csv):
+            CatalogGenerator(self.seed).write_csv(self.csv, self.size)
+
+    def setup_database(self):
+        if not os.path.exists(self.database):
+            container = self.container()
+            container.save_data(self.database, "DB")
+            container.close_database()
+
+    def remove(self, *filenames):
+        for filename in filenames:
+            if os.path.exists(filename):
+                os.remove(filename)
+
+    def loaded(self):
+        """Return a container with the catalog loaded from the database"""
+        self.setup_database()
+        container = RecipeContainer()
+        container.load_data(self.database, "DB")
+        return container
+
+    def db_save(self):
+        filename = os.path.join(self.directory, "save.db")
+        self.remove(filename, filename + ".snapshot")
+        container = self.container()
+        return lambda: container.save_data(filename, "DB")
+
+    def db_load(self):
+        self.setup_database()
+        self.remove(self.database + ".snapshot")
+        return lambda: RecipeContainer().load_data(self.database, "DB")
+
+    def db_load_snapshot(self):
+        self.loaded().close_database()
+        return lambda: RecipeContainer().load_data(self.database, "DB")
+
+    def csv_import(self):
+        self.setup_csv()
+        return lambda: RecipeContainer().load_data(self.csv, "FILE")
+
+    def csv_import_database(self):
+        self.setup_csv()
+        filename = os.path.join(self.directory, "import.db")
+        self.remove(filename, filename + "-wal", filename + "-shm")
+
+        def run():
+            container = RecipeContainer()
+            try:
+                return container.import_into_database(self.csv, filename)
+            finally:
+                container.close_database()
+        return run
+
+    def csv_validate_parallel(self):
+        self.setup_csv()
+
+        def run():
+            rows = (row for row in ImportExportHandler(self.csv, None) if type(row) is dict)
+            validator = BulkValidator(RecipeContainer.expiry_day, 10000, processes=None)
+            num = sum(1 for result in validator.validate(rows))
+            return True, "Validated {0} rows, rejected {1}".format(num, len(validator.rejected))
+        return run
+
+    def csv_export(self):
+        filename = os.path.join(self.directory, "export.csv")
+        self.remove(filename)
+        container = self.container()
+        return lambda: container.save_data(filename, "FILE")
+
+    def planning(self):
+        container = self.loaded()
+        start = container.current_day - container.weekday(container.current_day)
+
+        def run():
+            container.invalidate_plans()
+            container.select_recipes(True, start, start + 52 * 7)
+            planned = sum(1 for recipe_id in container.recipe_map.values() if recipe_id is not None)
+            return True, "Planned {0} of {1} days".format(planned, len(container.recipe_map))
+        return run
+
+    def view_population(self):
+        try:
+            from PyQt4.QtCore import Qt
+            from PyQt4.QtGui import QApplication
+            from Qhar_models import RecipeTableModel
+        except ImportError:
+            raise Skipped("PyQt4 is not installed")
+        if QApplication.instance() is None:
+            # without the GUI, so it runs on machines without a display
+            self.application = QApplication(sys.argv[:1], False)
+        container = self.loaded()
+        model = RecipeTableModel(container)
+        filters = [frozenset(container.recipe_types.values())] + \
+                  [frozenset([recipe_type]) for recipe_type in container.recipe_types.values()]
+
+        def run():
+            rows = 0
+            for recipe_filter in filters:
+                container.filter = recipe_filter
+                for column in (None, 2):
+                    # unsorted, then sorted by name like a click on the header
+                    if column is None:
+                        model.reset_recipes()
+                    else:
+                        model.sort(column, Qt.AscendingOrder)
+                    # the rows visible in the view
+                    for row in range(min(50, model.rowCount())):
+                        for col in range(model.columnCount()):
+                            model.data(model.index(row, col), Qt.DisplayRole)
+                            model.data(model.index(row, col), Qt.UserRole)
+                    rows += model.rowCount()
+            return True, "Populated {0} views with {1} rows".format(2 * len(filters), rows)
+        return run
+
+    def run(self, scenario, repeat):
+        """Run scenario repeat times and return its result"""
+        result = {"scenario": scenario, "size": self.size, "ok": True, "message": None}
+        times = []
+        try:
+            for num in range(repeat):
+                function = getattr(self, scenario)()
+                start = time.perf_counter()
+                ret = function()
+                times.append(time.perf_counter() - start)
+                if ret is not None and len(ret) == 2:
+                    result["ok"], result["message"] = ret
+        except Skipped as e:
+            result.update(ok=None, message="Skipped: {0}".format(e))
+            return result
+        except Exception as e:
+            result.update(ok=False, message="{0}: {1}".format(type(e).__name__, e))
+            return result
+        result.update(seconds=min(times), median=statistics.median(times), runs=times,
+                      rows_per_second=self.size / min(times) if min(times) > 0 else None)
+        return result
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline, results):
+    """Print the change of every result against the baseline"""
+    old = {(item["scenario"], item["size"]): item for item in baseline["results"]}
+    print("{0:<24}{1:>10}{2:>12}{3:>12}{4:>9}".format("scenario", "size", "baseline", "current", "ratio"))
+    for item in results:
+        before = old.get((item["scenario"], item["size"]))
+        if before is None or "seconds" not in before or "seconds" not in item:
+            continue
+        print("{0:<24}{1:>10}{2:>12.4f}{3:>12.4f}{4:>8.2f}x".format(
+            item["scenario"], item["size"], before["seconds"], item["seconds"],
+            before["seconds"] / item["seconds"] if item["seconds"] > 0 else float("inf")))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark Qhar on synthetic recipe catalogs.")
+    parser.add_argument("--sizes", default="1000,10000,100000",
+                        help="comma separated catalog sizes (default: 1000,10000,100000)")
+    parser.add_argument("--scenarios", default=",".join(Benchmark.scenarios),
+                        help="comma separated scenarios (default: all)")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the catalog generator (default: 0)")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per scenario (default: 3)")
+    parser.add_argument("--output", default="-", help="JSON file to write (default: standard output)")
+    parser.add_argument("--compare", default=None, help="JSON file of an earlier run to compare with")
+    args = parser.parse_args(argv)
+    sizes = [int(size) for size in args.sizes.split(",")]
+    scenarios = args.scenarios.split(",")
+    for scenario in scenarios:
+        if scenario not in Benchmark.scenarios:
+            parser.error("unknown scenario {0}".format(scenario))
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix="qhar-benchmark-") as directory:
+        for size in sizes:
+            benchmark = Benchmark(size, args.seed, directory)
+            for scenario in scenarios:
+                result = benchmark.run(scenario, args.repeat)
+                results.append(result)
+                if "seconds" in result:
+                    print("{0:<24}{1:>10}{2:>12.4f} s  {3}".format(scenario, size, result["seconds"],
+                                                                   result["message"] or ""), file=sys.stderr)
+                else:
+                    print("{0:<24}{1:>10}  {2}".format(scenario, size, result["message"]), file=sys.stderr)
+    output = {"meta": {"date": datetime.now().isoformat(timespec="seconds"),
+                       "revision": git_revision(),
+                       "python": platform.python_version(),
+                       "platform": platform.platform(),
+                       "seed": args.seed,
+                       "repeat": args.repeat},
+              "results": results}
+    if args.output == "-":
+        json.dump(output, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    else:
+        with open(args.output, "w") as outfile:
+            json.dump(output, outfile, indent=2)
+    if args.compare is not None:
+        with open(args.compare) as infile:
+            compare(json.load(infile), results)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
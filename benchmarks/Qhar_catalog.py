@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+# This file is part of Qhar.
+# Qhar is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# Qhar is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with Qhar.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Generate synthetic recipe catalogs. The same seed, size and reference
+date always give the same catalog, e.g.
+
+    Qhar_catalog.py 100000 catalog.csv --seed 7 --date 2024-01-15
+
+The reference date is today by default: last_cooked dates are drawn as days
+before it, so catalogs generated on different days differ only by that
+shift and are planned alike.
+"""
+
+import argparse
+import csv
+import os
+import random
+import sys
+from datetime import date, datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Qhar_schema import Schema
+from Qhar_settings import Calendar
+from Qhar_validation import recipe_hash
+
+SYLLABLES = ("ka", "ro", "mi", "ša", "po", "le", "ti", "na", "vo", "že", "su", "ra",
+             "bi", "do", "ča", "ne", "lu", "go", "pe", "si")
+# (minutes, weight), most recipes take about an hour
+TIME_TO_COOK = ((10, 2), (15, 4), (20, 6), (30, 14), (45, 16), (60, 22), (75, 8),
+                (90, 12), (120, 10), (150, 3), (180, 3))
+# (recipe type, weight)
+RECIPE_TYPES = (("one_course_meal", 25), ("side_dish", 15), ("main_course_with_meat", 28),
+                ("main_course_with_vegetables", 20), ("soup", 12))
+
+
+class CatalogGenerator(Schema, Calendar):
+    """This object generates rows like the ones read from a CSV file (dicts
+    of strings). Books follow a long tail distribution, every recipe in a
+    book has its own page, main courses often have a side dish and a few
+    recipes were cooked in the two weeks before reference_day (a day ordinal,
+    by default the current day)."""
+    def __init__(self, seed=0, side_dish_ratio=0.4, exact_ratio=0.3, cooked_ratio=0.01, reference_day=None):
+        super(CatalogGenerator, self).__init__()
+        self.seed = seed
+        self.reference_day = reference_day if reference_day is not None else self.current_day
+        self.side_dish_ratio = side_dish_ratio
+        self.exact_ratio = exact_ratio
+        self.cooked_ratio = cooked_ratio
+
+    def name(self, rnd):
+        words = [("".join(rnd.choice(SYLLABLES) for num in range(rnd.randint(2, 4)))).capitalize()
+                 for word in range(rnd.randint(1, 3))]
+        return " ".join(words)
+
+    def rows(self, count):
+        """Yield count rows"""
+        rnd = random.Random(self.seed)
+        books = ["{0} {1}".format(self.name(rnd), num) for num in range(max(5, count // 200))]
+        pages = dict()
+        times = [time for time, weight in TIME_TO_COOK]
+        time_weights = [weight for time, weight in TIME_TO_COOK]
+        types = [self.recipe_types[key] for key, weight in RECIPE_TYPES]
+        type_weights = [weight for key, weight in RECIPE_TYPES]
+        main_courses = frozenset([self.recipe_types["main_course_with_meat"],
+                                  self.recipe_types["main_course_with_vegetables"]])
+        side_dishes = []
+        for num in range(count):
+            # a few books hold most of the recipes
+            book = books[min(int(rnd.paretovariate(1.2)) - 1, len(books) - 1)]
+            pages[book] = pages.get(book, 0) + 1
+            row = {"name": "{0} {1}".format(self.name(rnd), num),
+                   "book": book,
+                   "page": str(pages[book]),
+                   "time_to_cook": str(rnd.choices(times, time_weights)[0]),
+                   "recipe_type": rnd.choices(types, type_weights)[0]}
+            if rnd.random() < self.exact_ratio:
+                row["exact_time_to_cook"] = "1"
+            if rnd.random() < self.cooked_ratio:
+                # never expired at the reference day
+                last_cooked = date.fromordinal(self.reference_day - rnd.randint(0, 13))
+                row["last_cooked"] = last_cooked.strftime(self.date_format)
+            if row["recipe_type"] == self.recipe_types["side_dish"]:
+                side_dishes.append(recipe_hash(row["name"], row["book"], row["page"]))
+            elif row["recipe_type"] in main_courses and side_dishes and rnd.random() < self.side_dish_ratio:
+                row["side_dish_id"] = rnd.choice(side_dishes)
+            yield row
+
+    def write_csv(self, filename, count):
+        """Write count rows to filename in the format read by Qhar"""
+        keys = list(self.arguments)
+        with open(filename, "w", newline="", encoding="utf-8") as csvfile:
+            writer = csv.writer(csvfile, delimiter="\t", quotechar="|")
+            writer.writerow([self.arguments[key] for key in keys])
+            for row in self.rows(count):
+                writer.writerow([row.get(key, "") for key in keys])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic recipe catalog as CSV.")
+    parser.add_argument("count", type=int, help="number of recipes")
+    parser.add_argument("filename", help="CSV file to write")
+    parser.add_argument("--seed", type=int, default=0, help="random seed (default: 0)")
+    parser.add_argument("--date", help="reference date of the last_cooked dates, YYYY-MM-DD (default: today)")
+    args = parser.parse_args(argv)
+    reference_day = None
+    if args.date is not None:
+        try:
+            reference_day = datetime.strptime(args.date, "%Y-%m-%d").date().toordinal()
+        except ValueError:
+            parser.error("invalid date: {0}".format(args.date))
+    CatalogGenerator(args.seed, reference_day=reference_day).write_csv(args.filename, args.count)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())